@@ -4,66 +4,283 @@ import os
 import sys
 import asyncio
 import pandas as pd
-from scripts.base import json_parse
-from volcenginesdkarkruntime import AsyncArk
-from scripts.prompts import prompt_abstract_filter
-from scripts.llm_info import api_key, model_abstract_filter
+from scripts.llm import close_clients
+from scripts.engine import ScreeningEngine, TRACE_COLUMNS
+from scripts.dedup import Deduplicator
+from scripts.prefilter import PreFilter, default_rules_file
+from scripts.distill import DistilledGate
+from scripts.readers import read_records, detect_format, INPUT_FORMATS
+from scripts.ledger import ScreeningLedger, prompt_version
+from scripts.shard import parse_shard, in_shard, ShardLease
+from scripts.output import open_sink, write_parquet, OUTPUT_FORMATS
+from scripts.checkpoint import Journal, load_completed_tsv, is_error
+from scripts.prompts import prompt_abstract_filter, prompt_abstract_filter_batch
+from scripts.llm_info import model_abstract_filter, model_abstract_filter_small
 
-MAX_CONCURRENT_REQUESTS = 100
-client = AsyncArk(api_key=api_key, timeout=3600 * 1)
+# in-flight requests start at INITIAL_CONCURRENCY and adapt (AIMD) up to MAX_CONCURRENCY
+INITIAL_CONCURRENCY = 100
+MAX_CONCURRENCY = 400
+# result columns written in stream mode
+RESULT_COLUMNS = ['Decision', 'Reason_id', 'Result', 'Duplicate_of', 'Prefilter', 'Tier', 'Gate', 'Votes',
+                  'Agreement']
 
 
-async def fetch_model_response(session_id, content, semaphore, model, cycle_num=5):
-    messages = [
-        {
-            "role": "system",
-            "content": prompt_abstract_filter
-        },
-        {
-            "role": "user",
-            "content": content
-        }
-    ]
-    async with semaphore:
-        for i in range(cycle_num):
-            try:
-                completion = await client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=0.01,
-                    top_p=0.7,
-                )
-                response_content = ' '.join(
-                    completion.choices[0].message.content.replace('，', ',').replace('：', ':').split()
-                )
-                response = json_parse(response_content)
-                return session_id, response
-            except Exception as e:
-                print(f"[{i + 1}/{cycle_num}] Error in session {session_id}: {e}")
-                if i + 1 == cycle_num:
-                    response = {'Result': f'Error:{e}'}
-                    return session_id, response
-        return session_id, response
-
-
-async def handle_multiple_sessions(sessions, model, cycle_num=5):
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    tasks = [
-        fetch_model_response(
-            session_id, content, semaphore, model, cycle_num) for session_id, content in sessions.items()
-    ]
-    results = await asyncio.gather(*tasks)
+def make_engine(model, escalate_model=None, pack_size=1, pack_tokens=6000, prepare=None, cycle_num=5,
+                vote_samples=0, vote_temperature=0.7, trace=False):
+    """
+    Screening engine of the abstract prompt, see `ScreeningEngine` for the parameters.
+    """
+    return ScreeningEngine(
+        prompt_abstract_filter, model, 'abstract filter', INITIAL_CONCURRENCY, MAX_CONCURRENCY,
+        params={'temperature': 0.01, 'top_p': 0.7}, cycle_num=cycle_num, escalate_model=escalate_model,
+        batch_prompt=prompt_abstract_filter_batch, pack_size=pack_size, pack_tokens=pack_tokens, prepare=prepare,
+        unit='abstracts', vote_samples=vote_samples, vote_temperature=vote_temperature, trace=trace)
+
+
+async def handle_multiple_sessions(sessions, model, cycle_num=5, journal=None, pack_size=1, pack_tokens=6000,
+                                   escalate_model=None, vote_samples=0, vote_temperature=0.7, trace=False):
+    engine = make_engine(model, escalate_model, pack_size, pack_tokens, cycle_num=cycle_num,
+                         vote_samples=vote_samples, vote_temperature=vote_temperature, trace=trace)
+    results = []
+    async for session_id, _, response in engine.run(sessions.items(), MAX_CONCURRENCY):
+        if journal:
+            journal.append(session_id, response)
+        results.append((session_id, response))
+    engine.summary()
     return results
 
 
+def read_sessions(file_name, chunk_size, completed=(), input_format='auto', shard=None):
+    for session_id, abstract in read_records(file_name, input_format, chunk_size):
+        if str(session_id) not in completed and in_shard(session_id, shard):
+            yield session_id, abstract
+
+
+async def stream_sessions(sessions, output_file_name, model, workers, cycle_num=5, dedup=None, pack_size=1,
+                          pack_tokens=6000, prefilter=None, escalate_model=None, gate=None, ledger=None,
+                          vote_samples=0, vote_temperature=0.7, output_format='tsv'):
+    """
+    Screen (session_id, abstract) pairs with a fixed pool of workers, appending each result as soon as it finishes,
+    so memory depends on `workers` and not on the input size.
+    :param sessions: iterator of (session_id, abstract)
+    :param output_file_name: headerless tsv: session_id, abstract, `RESULT_COLUMNS`, or Parquet file with the same
+                             columns and `TRACE_COLUMNS`
+    :param model: model name
+    :param workers: number of workers, also the queue size
+    :param dedup: optional Deduplicator, duplicates reuse the decision of the first copy
+    :param pack_size: abstracts per request (see `ScreeningEngine.fetch_packed`)
+    :param pack_tokens: estimated token budget of the abstracts of one request
+    :param prefilter: optional PreFilter, abstracts it rejects are not sent to the LLM
+    :param escalate_model: strong model of cascade mode, `model` is then the small one
+    :param gate: optional DistilledGate, abstracts it confidently rejects are not sent to the LLM
+    :param ledger: optional ScreeningLedger, its decisions are reused and new decisions are recorded in it
+    :param vote_samples: k > 1 screens undecided abstracts again with k samples and keeps the majority decision
+    :param vote_temperature: sampling temperature of the votes
+    :param output_format: `tsv` or `parquet`
+    """
+    def gate_prepare(batch):
+        abstracts = [abstract for _, abstract in batch]
+        return [(abstract, {}, response) for abstract, response in zip(abstracts, gate.screen(abstracts))]
+
+    prepare = gate_prepare if gate else None
+    parquet = output_format == 'parquet'
+    engine = make_engine(model, escalate_model, pack_size, pack_tokens, prepare, cycle_num, vote_samples,
+                         vote_temperature, trace=parquet)
+    # decisions of screened representatives, and duplicates waiting for a representative still in flight
+    finished, waiting = {}, {}
+
+    columns = ['session_id', 'abstract'] + RESULT_COLUMNS + (TRACE_COLUMNS if parquet else [])
+    output = open_sink(output_file_name, columns, output_format)
+
+    def write(session_id, abstract, response, record=True):
+        output.write(dict(response, session_id=session_id, abstract=abstract))
+        if ledger and record and not is_error(response) and not is_local(response, prefilter):
+            ledger.put(session_id, abstract, ledger_response(response))
+
+    def finish(session_id, abstract, response):
+        write(session_id, abstract, response)
+        if dedup:
+            finished[session_id] = response
+            for duplicate_id, duplicate in waiting.pop(session_id, []):
+                write(duplicate_id, duplicate, duplicate_response(response, session_id))
+
+    def distinct_sessions():
+        for session_id, abstract in sessions:
+            if ledger:
+                response = ledger.get(session_id, abstract)
+                if response is not None:
+                    write(session_id, abstract, response, record=False)
+                    continue
+            if dedup:
+                representative, new = dedup.add(session_id, abstract)
+                if not new:
+                    if representative in finished:
+                        write(session_id, abstract, duplicate_response(finished[representative], representative))
+                    else:
+                        waiting.setdefault(representative, []).append((session_id, abstract))
+                    continue
+            if prefilter:
+                response = prefilter.screen(abstract)
+                if response:
+                    finish(session_id, abstract, response)
+                    continue
+            yield session_id, abstract
+
+    def sink(session_id, abstract, response):
+        if prefilter and 'Gate' not in response:
+            response = prefilter.audit(abstract, response)
+        finish(session_id, abstract, response)
+
+    try:
+        await engine.process(distinct_sessions(), sink, workers)
+    finally:
+        output.close()
+    engine.summary()
+
+
+def duplicate_response(response, representative):
+    # a duplicate made no request of its own
+    return dict({k: v for k, v in response.items() if k not in TRACE_COLUMNS}, Duplicate_of=representative)
+
+
+def ledger_response(response):
+    # duplicate links and request traces are only meaningful within one run
+    return {k: v for k, v in response.items() if k != 'Duplicate_of' and k not in TRACE_COLUMNS}
+
+
+def is_local(response, prefilter=None):
+    """
+    :return: whether the prefilter or the gate took the decision, such decisions depend on the rules, gate model and
+             threshold of the run and are not recorded in the ledger (a prefilter in audit mode only tags LLM results)
+    """
+    return 'Gate' in response or bool(prefilter and not prefilter.audit_mode and response.get('Prefilter'))
+
+
+def get_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='abstract filter for CanRisk-DB')
+    parser.add_argument('input_file', type=str,
+                        help='tsv without header: abstract id, abstract (.gz/.zst allowed), PubMed XML or RIS export.')
+    parser.add_argument('--input_format', type=str, default='auto', choices=INPUT_FORMATS,
+                        help='Format of input_file, guessed from the extension by default (.xml, .ris, else tsv).')
+    parser.add_argument('output_file', type=str, help='tsv without header: input columns + screening result.')
+    parser.add_argument('--output_format', type=str, default='tsv', choices=OUTPUT_FORMATS,
+                        help='Format of output_file, parquet has typed columns written in row groups, with the model, '
+                             'latency, tokens and cache hit of each LLM decision (needs pyarrow).')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read the input in chunks and write each result as it finishes (flat memory).')
+    parser.add_argument('--chunk_size', type=int, default=10000, help='Rows read per chunk in stream mode.')
+    parser.add_argument('--workers', type=int, default=MAX_CONCURRENCY, help='Worker pool size in stream mode.')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Screen each distinct abstract once and copy the decision to its duplicates.')
+    parser.add_argument('--near_dup', type=float, default=0.0,
+                        help='With --dedup, also merge near duplicates above this MinHash similarity (e.g. 0.9).')
+    parser.add_argument('--pack', type=int, default=1,
+                        help='Abstracts screened per request, abstracts missing from an answer are re-queued alone.')
+    parser.add_argument('--pack_tokens', type=int, default=6000,
+                        help='Estimated token budget of the abstracts packed into one request.')
+    parser.add_argument('--prefilter', action='store_true',
+                        help='Reject clear cases (reviews, case reports, animal studies...) with rules before the LLM.')
+    parser.add_argument('--prefilter_rules', type=str, default=default_rules_file,
+                        help='Rule table of --prefilter (tsv: rule, reason_id, lang, pattern, unless).')
+    parser.add_argument('--prefilter_audit', action='store_true',
+                        help='Send everything to the LLM and report how often it agrees with each rule.')
+    parser.add_argument('--gate', type=str, default=None,
+                        help='Local classifier trained by `python -m scripts.distill train`, abstracts it rejects '
+                             'with enough confidence are not sent to the LLM.')
+    parser.add_argument('--gate_threshold', type=float, default=0.98,
+                        help='Minimal P(Rejected) of --gate, pick it from the table printed at training.')
+    parser.add_argument('--cascade', action='store_true',
+                        help='Screen with model_abstract_filter_small, escalate Uncertain or unparsed answers to '
+                             'model_abstract_filter.')
+    parser.add_argument('--vote', type=int, default=0,
+                        help='Screen Uncertain or unparsed answers again with this many samples (one request with '
+                             'n samples where supported) and keep the majority decision, with Votes and Agreement.')
+    parser.add_argument('--vote_temperature', type=float, default=0.7, help='Sampling temperature of --vote.')
+    parser.add_argument('--ledger', type=str, default=None,
+                        help='SQLite ledger of earlier runs: abstracts already screened with the same id, text and '
+                             'prompt reuse their decision, the others are screened and recorded.')
+    parser.add_argument('--prompt_version', type=str, default=None,
+                        help='Prompt version of the ledger entries, a digest of the prompts and models of the run by '
+                             'default.')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                        help='Only screen shard i of N (0 <= i < N, e.g. 0/4), split by a stable hash of the id.')
+    parser.add_argument('--lease_dir', type=str, default=None,
+                        help='With --shard, a directory shared by the machines where the running shards register, '
+                             'each of them uses an equal share of the rate limit.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run, only the sessions without a result are submitted.')
+    parser.add_argument('--retry_errors', action='store_true',
+                        help='Like --resume, and also submit again the sessions whose result is "Error:".')
+    args = parser.parse_args()
+    return args
+
+
 async def main():
-    abstract_file_name = sys.argv[1]
-    output_file_name = sys.argv[2]
+    args = get_args()
+    abstract_file_name = args.input_file
+    output_file_name = args.output_file
+    resume = args.resume or args.retry_errors
+    # results are journaled as they finish, the output file is written at the end (not needed in stream mode)
+    journal = Journal(f'{output_file_name}.journal')
 
-    if os.path.exists(output_file_name):
-        sys.exit('Output file already exists.')
+    if not resume and (os.path.exists(output_file_name) or journal.exists()):
+        sys.exit('Output file already exists, use --resume to continue it.')
+    if args.lease_dir and not args.shard:
+        sys.exit('--lease_dir needs --shard.')
+    if args.stream and resume and args.output_format == 'parquet':
+        sys.exit('A Parquet file can not be appended to, use tsv output to resume --stream runs.')
 
-    df = pd.read_table(abstract_file_name, header=None)
+    model, escalate_model = model_abstract_filter, None
+    if args.cascade:
+        model, escalate_model = model_abstract_filter_small, model_abstract_filter
+    dedup = Deduplicator(args.near_dup) if args.dedup else None
+    prefilter = None
+    if args.prefilter or args.prefilter_audit:
+        prefilter = PreFilter(args.prefilter_rules, audit=args.prefilter_audit)
+    gate = DistilledGate(args.gate, args.gate_threshold) if args.gate else None
+    ledger = None
+    if args.ledger:
+        # packing, cascade and voting change the prompts and models behind a decision
+        version = prompt_version(
+            prompt_abstract_filter, prompt_abstract_filter_batch if args.pack > 1 else '', model, escalate_model or '',
+            f'vote {args.vote} {args.vote_temperature}' if args.vote else '')
+        ledger = ScreeningLedger(args.ledger, args.prompt_version or version)
+    lease = ShardLease(args.lease_dir, args.shard) if args.lease_dir else None
+    if args.stream:
+        completed = set()
+        if resume:
+            completed = load_completed_tsv(output_file_name, 2 + RESULT_COLUMNS.index('Result'), args.retry_errors)
+            print(f'{len(completed)} sessions already screened.')
+        if lease:
+            lease.start()
+        try:
+            await stream_sessions(
+                read_sessions(abstract_file_name, args.chunk_size, completed, args.input_format, args.shard),
+                output_file_name,
+                model, args.workers, dedup=dedup, pack_size=args.pack, pack_tokens=args.pack_tokens,
+                prefilter=prefilter, escalate_model=escalate_model, gate=gate, ledger=ledger,
+                vote_samples=args.vote, vote_temperature=args.vote_temperature, output_format=args.output_format)
+        finally:
+            if lease:
+                await lease.stop()
+            await close_clients()
+            if ledger:
+                ledger.close()
+        if ledger:
+            ledger.report()
+        if dedup:
+            dedup.report()
+        if prefilter:
+            prefilter.report()
+        if gate:
+            gate.report()
+        return
+
+    if args.input_format == 'tsv' or args.input_format == 'auto' and detect_format(abstract_file_name) == 'tsv':
+        df = pd.read_table(abstract_file_name, header=None)
+    else:
+        df = pd.DataFrame(read_records(abstract_file_name, args.input_format))
     df.rename(
         columns={
             0: 'session_id',
@@ -71,16 +288,84 @@ async def main():
         },
         inplace=True
     )
-    sessions = dict(zip(list(df['session_id']), list(df['abstract'])))
-    results = await handle_multiple_sessions(sessions, model_abstract_filter)
+    if args.shard:
+        df = df[[in_shard(session_id, args.shard) for session_id in df['session_id']]]
+    completed = journal.load(args.retry_errors) if resume else {}
+    sessions = zip(list(df['session_id']), list(df['abstract']))
+    duplicates = {}
+    if dedup:
+        sessions, duplicates = dedup.split(sessions)
+        dedup.report()
+    sessions = {
+        session_id: abstract for session_id, abstract in dict(sessions).items() if str(session_id) not in completed
+    }
+    reused = set()
+    if ledger:
+        for session_id, abstract in list(sessions.items()):
+            response = ledger.get(session_id, abstract)
+            if response is not None:
+                completed[str(session_id)] = response
+                reused.add(str(session_id))
+                del sessions[session_id]
+        ledger.report()
+    screened = []
+    if prefilter:
+        for session_id, abstract in list(sessions.items()):
+            response = prefilter.screen(abstract)
+            if response:
+                screened.append((session_id, response))
+                journal.append(session_id, response)
+                del sessions[session_id]
+    if gate:
+        for (session_id, abstract), response in zip(list(sessions.items()), gate.screen(list(sessions.values()))):
+            if response:
+                screened.append((session_id, response))
+                journal.append(session_id, response)
+                del sessions[session_id]
+        gate.report()
+    print(f'{len(completed)} sessions already screened, {len(sessions)} to submit.')
+    if lease:
+        lease.start()
+    try:
+        results = await handle_multiple_sessions(
+            sessions, model, journal=journal, pack_size=args.pack, pack_tokens=args.pack_tokens,
+            escalate_model=escalate_model, vote_samples=args.vote, vote_temperature=args.vote_temperature,
+            trace=args.output_format == 'parquet')
+    finally:
+        if lease:
+            await lease.stop()
+        journal.close()
+        await close_clients()
+    if prefilter:
+        results = [(session_id, prefilter.audit(sessions[session_id], r)) for session_id, r in results]
+        prefilter.report()
+    results += screened
 
-    result_dict = {}
     for session_id, response in results:
-        result_dict[session_id] = response
+        completed[str(session_id)] = response
+    for session_id, representative in duplicates.items():
+        if str(representative) in completed:
+            completed[str(session_id)] = duplicate_response(completed[str(representative)], representative)
+    if ledger:
+        for session_id, abstract in zip(df['session_id'], df['abstract']):
+            response = completed.get(str(session_id))
+            if (response is not None and str(session_id) not in reused and not is_error(response)
+                    and not is_local(response, prefilter)):
+                ledger.put(session_id, abstract, ledger_response(response))
+        ledger.close()
+    if args.output_format == 'parquet':
+        write_parquet(df, completed, output_file_name, RESULT_COLUMNS + TRACE_COLUMNS)
+        journal.remove()
+        return
+    result_dict = {}
+    for session_id in df['session_id']:
+        if str(session_id) in completed:
+            result_dict[session_id] = completed[str(session_id)]
 
     dfrst = pd.DataFrame(result_dict).T
     dfM = pd.merge(df, dfrst, left_on='session_id', right_index=True)
     dfM.to_csv(output_file_name, index=False, sep='\t', header=False)
+    journal.remove()
 
 
 if __name__ == '__main__':
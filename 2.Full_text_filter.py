@@ -2,66 +2,165 @@
 # SPDX-License-Identifier: MIT
 import os
 import sys
+import mmap
 import asyncio
 import pandas as pd
-from scripts.base import json_parse
-from volcenginesdkarkruntime import AsyncArk
+from scripts.llm import close_clients
+from scripts.engine import ScreeningEngine, TRACE_COLUMNS
+from scripts.output import write_parquet, OUTPUT_FORMATS
+from scripts.checkpoint import Journal
+from scripts.sections import budget_text
+from scripts.statcheck import StatChecker
+from scripts.shard import parse_shard, in_shard, ShardLease
 from scripts.prompts import prompt_full_text_filter
-from scripts.llm_info import api_key, model_full_text_filter
+from scripts.llm_info import model_full_text_filter, model_full_text_filter_small
 
-MAX_CONCURRENT_REQUESTS = 30
-client = AsyncArk(api_key=api_key, timeout=3600 * 1)
+# in-flight requests start at INITIAL_CONCURRENCY and adapt (AIMD) up to MAX_CONCURRENCY
+INITIAL_CONCURRENCY = 30
+MAX_CONCURRENCY = 120
+# estimated tokens of the full texts before and after --token_budget
+BUDGET_STATS = {'papers': 0, 'before': 0, 'after': 0}
 
 
-async def fetch_model_response(session_id, content, semaphore, model, cycle_num=5):
-    messages = [
-        {
-            "role": "system",
-            "content": prompt_full_text_filter
-        },
-        {
-            "role": "user",
-            "content": content
-        }
-    ]
-    async with semaphore:
-        for i in range(cycle_num):
+def read_text(path, use_mmap=False):
+    with open(path, 'rb') as f:
+        if use_mmap and os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, memoryview(m) as view:
+                return str(view, 'utf-8')
+        return f.read().decode('utf-8')
+
+
+def load_text(path, use_mmap=False, token_budget=0, stat_checker=None):
+    """
+    :return: (text to screen, extra result columns: `Stat_hits`/`Stat_snippets` with a StatChecker, `Tokens_full`/
+             `Tokens_sent` with a token budget)
+    """
+    content = read_text(path, use_mmap)
+    columns = {}
+    if stat_checker:
+        # on the whole text, the budget may drop the tables
+        columns.update(stat_checker.scan(content))
+    if token_budget:
+        content, columns['Tokens_full'], columns['Tokens_sent'] = budget_text(content, token_budget)
+    return content, columns
+
+
+def budget_report():
+    if BUDGET_STATS['papers']:
+        before, after = BUDGET_STATS['before'], BUDGET_STATS['after']
+        print(f"token budget: {BUDGET_STATS['papers']} papers, {before} -> {after} estimated tokens "
+              f"({1 - after / max(before, 1):.1%} saved).")
+
+
+def make_engine(model, escalate_model=None, use_mmap=False, token_budget=0, stat_checker=None, cycle_num=5,
+                vote_samples=0, vote_temperature=0.7, trace=False):
+    """
+    Screening engine of the full text prompt. Records are (paper id, path of the parsed full text), each text is read
+    by a worker right before its request. A file that can not be read gets an `Error:` result.
+    :param use_mmap: read the files through mmap
+    :param token_budget: keep only the most useful sections within this many estimated tokens (see `budget_text`),
+                         the result then records `Tokens_full` and `Tokens_sent`; 0 sends the whole text
+    :param stat_checker: optional StatChecker, its columns are added to the results and, in reject mode, papers
+                         without RR/HR/SIR are rejected without the LLM
+    :param vote_samples: k > 1 screens undecided papers again with k samples and keeps the majority decision
+    :param vote_temperature: sampling temperature of the votes
+    :param trace: add the model, latency, tokens and cache hit of the LLM decisions (see `ScreeningEngine`)
+    """
+    def prepare(batch):
+        prepared = []
+        for session_id, path in batch:
             try:
-                completion = await client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=0.1,
-                    # top_p=0.7,
-                )
-                response_content = ' '.join(
-                    completion.choices[0].message.content.replace('，', ',').replace('：', ':').split()
-                )
-                response = json_parse(response_content)
-                return session_id, response
+                content, columns = load_text(path, use_mmap, token_budget, stat_checker)
             except Exception as e:
-                print(f"[{i + 1}/{cycle_num}] Error in session {session_id}: {e}")
-                if i + 1 == cycle_num:
-                    response = {'Result': f'Error:{e}'}
-                    return session_id, response
-        return session_id, response
-
-
-async def handle_multiple_sessions(sessions, model, cycle_num=5):
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    tasks = [
-        fetch_model_response(
-            session_id, content, semaphore, model, cycle_num) for session_id, content in sessions.items()
-    ]
-    results = await asyncio.gather(*tasks)
+                print(f'Can not read file: {session_id} ({e})')
+                prepared.append((None, {}, {'Result': f'Error:Can not read file: {e}'}))
+                continue
+            prepared.append((content, columns, stat_checker.screen(columns) if stat_checker else None))
+        return prepared
+
+    return ScreeningEngine(
+        prompt_full_text_filter, model, 'full text filter', INITIAL_CONCURRENCY, MAX_CONCURRENCY,
+        params={'temperature': 0.1}, cycle_num=cycle_num, escalate_model=escalate_model, prepare=prepare,
+        unit='papers', vote_samples=vote_samples, vote_temperature=vote_temperature, trace=trace)
+
+
+async def handle_multiple_sessions(sessions, model, cycle_num=5, journal=None, escalate_model=None,
+                                   workers=MAX_CONCURRENCY, use_mmap=False, token_budget=0, stat_checker=None,
+                                   vote_samples=0, vote_temperature=0.7, trace=False):
+    """
+    Screen papers with a fixed pool of workers, so memory depends on `workers` and not on the number of papers.
+    :param sessions: dict of session_id -> path of the parsed full text
+    :param workers: number of papers read and screened at the same time
+    """
+    engine = make_engine(model, escalate_model, use_mmap, token_budget, stat_checker, cycle_num, vote_samples,
+                         vote_temperature, trace)
+    results = []
+    async for session_id, _, response in engine.run(sessions.items(), workers):
+        if stat_checker and 'Stat_hits' in response:
+            stat_checker.record(response)
+        if 'Tokens_full' in response:
+            BUDGET_STATS['papers'] += 1
+            BUDGET_STATS['before'] += response['Tokens_full']
+            BUDGET_STATS['after'] += response['Tokens_sent']
+        if journal:
+            journal.append(session_id, response)
+        results.append((session_id, response))
+    engine.summary()
+    budget_report()
+    if stat_checker:
+        stat_checker.report()
     return results
 
 
+def get_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='full text filter for CanRisk-DB')
+    parser.add_argument('input_file', type=str, help='tsv without header: paper id, path of the parsed full text.')
+    parser.add_argument('output_file', type=str, help='tsv without header: input columns + screening result.')
+    parser.add_argument('--output_format', type=str, default='tsv', choices=OUTPUT_FORMATS,
+                        help='Format of output_file, parquet has typed columns written in row groups, with the model, '
+                             'latency, tokens and cache hit of each LLM decision (needs pyarrow).')
+    parser.add_argument('--workers', type=int, default=MAX_CONCURRENCY,
+                        help='Papers read and screened at the same time, bounds the memory used by full texts.')
+    parser.add_argument('--mmap', action='store_true', help='Read the full texts through mmap.')
+    parser.add_argument('--token_budget', type=int, default=0,
+                        help='Send at most this many estimated tokens per paper, keeping abstract, methods, results '
+                             'and tables first and dropping references (0: whole text).')
+    parser.add_argument('--stat_check', type=str, default=None, choices=['flag', 'reject'],
+                        help='Look for RR/HR/SIR with a confidence interval (rule 5) and add Stat_hits/Stat_snippets; '
+                             '"reject" also rejects papers without any hit without calling the LLM.')
+    parser.add_argument('--cascade', action='store_true',
+                        help='Screen with model_full_text_filter_small, escalate Uncertain or unparsed answers to '
+                             'model_full_text_filter.')
+    parser.add_argument('--vote', type=int, default=0,
+                        help='Screen Uncertain or unparsed answers again with this many samples (one request with '
+                             'n samples where supported) and keep the majority decision, with Votes and Agreement.')
+    parser.add_argument('--vote_temperature', type=float, default=0.7, help='Sampling temperature of --vote.')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                        help='Only screen shard i of N (0 <= i < N, e.g. 0/4), split by a stable hash of the id.')
+    parser.add_argument('--lease_dir', type=str, default=None,
+                        help='With --shard, a directory shared by the machines where the running shards register, '
+                             'each of them uses an equal share of the rate limit.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run, only the papers without a result are submitted.')
+    parser.add_argument('--retry_errors', action='store_true',
+                        help='Like --resume, and also submit again the papers whose result is "Error:".')
+    args = parser.parse_args()
+    return args
+
+
 async def main():
-    file_path = sys.argv[1]
-    output_file_name = sys.argv[2]
+    args = get_args()
+    file_path = args.input_file
+    output_file_name = args.output_file
+    resume = args.resume or args.retry_errors
+    # results are journaled as they finish, the output file is written at the end
+    journal = Journal(f'{output_file_name}.journal')
 
-    if os.path.exists(output_file_name):
-        sys.exit('Output file already exists.')
+    if not resume and (os.path.exists(output_file_name) or journal.exists()):
+        sys.exit('Output file already exists, use --resume to continue it.')
+    if args.lease_dir and not args.shard:
+        sys.exit('--lease_dir needs --shard.')
 
     df = pd.read_table(file_path, header=None)
     df.rename(
@@ -71,26 +170,57 @@ async def main():
         },
         inplace=True
     )
+    if args.shard:
+        df = df[[in_shard(session_id, args.shard) for session_id in df['session_id']]]
 
+    completed = journal.load(args.retry_errors) if resume else {}
     file_path_dict = dict(zip(list(df['session_id']), list(df['text_path'])))
-    sessions = {}
-    for file_id, file in file_path_dict.items():
-        try:
-            with open(file) as f:
-                file_content = f.read()
-            sessions[file_id] = file_content
-        except:
-            print(f'Can not read file: {file_id}')
+    # full texts are read by the workers, right before their request
+    sessions = {file_id: file for file_id, file in file_path_dict.items() if str(file_id) not in completed}
+    print(f'{len(completed)} papers already screened, {len(sessions)} to submit.')
+    stat_checker = StatChecker(reject=args.stat_check == 'reject') if args.stat_check else None
+    trace = args.output_format == 'parquet'
 
-    results = await handle_multiple_sessions(sessions, model_full_text_filter)
+    lease = ShardLease(args.lease_dir, args.shard) if args.lease_dir else None
+    if lease:
+        lease.start()
+    try:
+        if args.cascade:
+            results = await handle_multiple_sessions(
+                sessions, model_full_text_filter_small, journal=journal, escalate_model=model_full_text_filter,
+                workers=args.workers, use_mmap=args.mmap, token_budget=args.token_budget, stat_checker=stat_checker,
+                vote_samples=args.vote, vote_temperature=args.vote_temperature, trace=trace)
+        else:
+            results = await handle_multiple_sessions(
+                sessions, model_full_text_filter, journal=journal, workers=args.workers, use_mmap=args.mmap,
+                token_budget=args.token_budget, stat_checker=stat_checker, vote_samples=args.vote,
+                vote_temperature=args.vote_temperature, trace=trace)
+    finally:
+        if lease:
+            await lease.stop()
+        journal.close()
+        await close_clients()
 
-    result_dict = {}
     for session_id, response in results:
-        result_dict[session_id] = response
+        completed[str(session_id)] = response
+    if trace:
+        columns = ['Decision', 'Reason', 'Result']
+        if args.stat_check:
+            columns += ['Stat_hits', 'Stat_snippets']
+        if args.token_budget:
+            columns += ['Tokens_full', 'Tokens_sent']
+        write_parquet(df, completed, output_file_name, columns + TRACE_COLUMNS)
+        journal.remove()
+        return
+    result_dict = {}
+    for session_id in df['session_id']:
+        if str(session_id) in completed:
+            result_dict[session_id] = completed[str(session_id)]
 
     dfrst = pd.DataFrame(result_dict).T
     dfM = pd.merge(df, dfrst, left_on='session_id', right_index=True)
     dfM.to_csv(output_file_name, index=False, sep='\t', header=False)
+    journal.remove()
 
 
 if __name__ == '__main__':
@@ -1,42 +1,66 @@
 # Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
 # SPDX-License-Identifier: MIT
 import os
+import sys
+import csv
 import json
+import time
 import asyncio
-from lightrag import QueryParam
 from scripts.grade_agent import grade_agent
-from scripts.RAG_lightRAG import initialize_rag
+from scripts.llm import close_clients
+from scripts.RAG_lightRAG import initialize_rag, rag_insert, rag_context
 from scripts.theme_class_agent import theme_classifier_agent
+from scripts.dag import run_stages, GateClosed
+from scripts.cooccurrence import check_pairs
 from scripts.base import FileInfoCollector, merge_chunks
 from scripts.llm_info import model_vison, model_rag, model_agent
 from scripts.paper_parse import paper_str_parse, mul_modal_summary, mul_modal_chunk
 from scripts.level1_agents import cohort_agent, outcome_agent, cancer_agent, risk_factor_agent, group_agent
 
+# LightRAG keeps its pipeline status in process-wide storage, so papers build their RAG one at a time
+RAG_LOCK = asyncio.Lock()
+# per-paper results of --batch, appended as papers finish
+STATUS_FILE = 'batch_status.tsv'
+
 
 def get_args():
     import argparse
     parser = argparse.ArgumentParser(description='multi agent for CanRisk-DB')
-    parser.add_argument('-i', '--input_dir', type=str, required=True, help='The path to the input file.')
+    parser.add_argument('-i', '--input_dir', type=str, required=True,
+                        help='MinerU output of a paper; with --batch, a directory of them or a manifest file listing '
+                             'one paper directory per line.')
     parser.add_argument('-o', '--out_dir', type=str, default='.', help='The path of the output files.')
-    parser.add_argument('-r', '--rag_dir', type=str, default='', help='rag path of paper.')
+    parser.add_argument('-r', '--rag_dir', type=str, default='',
+                        help='rag path of paper; with --batch, a directory of rag paths named like the papers '
+                             '(papers without one get a new rag in their output directory).')
+    parser.add_argument('--batch', action='store_true',
+                        help='Process every paper of input_dir in one process, each into its own subdirectory of '
+                             f'out_dir, with a per-paper status in out_dir/{STATUS_FILE}.')
+    parser.add_argument('--papers_in_flight', type=int, default=4, help='Papers processed at the same time in --batch.')
+    parser.add_argument('--resume', action='store_true',
+                        help='With --batch, skip the papers already done or rejected in the status file.')
     parser.add_argument('--theme_class', action='store_true', help='Use theme class.')
     parser.add_argument('--grade', action='store_true', help='Use grade.')
+    parser.add_argument('--prune_pairs', action='store_true',
+                        help='Skip group extraction of the cancer x risk factor pairs never mentioned together in a '
+                             'result paragraph or table of the paper.')
     parser.add_argument('-l', '--lang', default='en', help='use English(en) or Chinese(ch) prompt.')
     args = parser.parse_args()
     return args
 
 
-async def main():
-    args = get_args()
-    input_dir = args.input_dir
-    out_path = args.out_dir
-    lang = args.lang
+async def process_paper(input_dir, out_path, rag_dir='', theme=False, grade=False, lang='en', prune=False):
+    """
+    Extract the information of one paper, writing its artifacts into `out_path`.
+    :param input_dir: MinerU output of the paper
+    :param rag_dir: existing LightRAG directory of the paper, built in `out_path`/paper_db if empty
+    :param prune: skip the cancer x risk factor pairs that never co-occur in the results (see `check_pairs`)
+    :return: `done`, or `rejected` by the theme classifier
+    """
     paper = FileInfoCollector(input_dir)
-    theme = args.theme_class
-    grade = args.grade
 
-    if args.rag_dir:
-        db_path = args.rag_dir
+    if rag_dir:
+        db_path = rag_dir
         is_rag = True
     else:
         db_path = os.path.join(out_path, 'paper_db')
@@ -47,106 +71,254 @@ async def main():
     text_content, image_paths = paper_str_parse(paper.md_files, paper.json_files)
     with open(f'{out_path}/text_parse.md', 'w') as file:
         file.write(text_content)
-    prompt_session = await mul_modal_summary(
-        text_content, image_paths, paper.image_path, model=model_vison, lang=lang)
-    if prompt_session:
-        with open(f'{out_path}/image_parse.json', 'w') as f:
-            json.dump(prompt_session, f, indent=4, ensure_ascii=False)
-        summary_chunks = mul_modal_chunk(prompt_session, paper.directory)
-    else:
-        summary_chunks = []
-    text_chunks = merge_chunks(text_content.split('\n\n'))
-    chunks = text_chunks + summary_chunks
-    chunks_not_empty = []
-    for i in chunks:
-        i = i.strip()
-        if i:
-            chunks_not_empty.append(i)
-    content = '\n\n'.join(chunks_not_empty)
-    with open(f'{out_path}/chunks.txt', 'w', encoding='utf-8') as file:
-        file.write(content)
 
-    if theme:
+    # 3.2 level 1
+    max_tokens = 12288
+    abs_path = os.path.split(os.path.realpath(__file__))[0]
+
+    saved = []
+
+    def save(file_name, info):
+        saved.append(file_name)
+        with open(f'{out_path}/{file_name}', 'w', encoding='utf-8') as file:
+            json.dump(info, file, indent=4, ensure_ascii=False)
+
+    async def theme_stage():
         theme_class = await theme_classifier_agent(text_content, model_agent, lang)
-        if theme_class['Decision'] == 'Rejected':
-            print('paper is not related to cancer risk.')
-            print(theme_class)
-            return
+        if theme_class.get('Decision') == 'Rejected':
+            raise GateClosed('theme', theme_class)
+        return theme_class
 
-    if grade:
+    async def grade_stage():
         grade_evaluator = await grade_agent(text_content, model_agent, lang)
-        with open(f'{out_path}/grade_evaluator.json', 'w', encoding='utf-8') as file:
-            json.dump(grade_evaluator, file, indent=4, ensure_ascii=False)
+        save('grade_evaluator.json', grade_evaluator)
+        return grade_evaluator
 
-    # print(len(chunks))
-    rag = await initialize_rag(db_path)
-    if not is_rag:
-        import nest_asyncio
-        nest_asyncio.apply()
-        rag.insert(content, '\n\n', True)
+    async def content_stage():
+        prompt_session = await mul_modal_summary(
+            text_content, image_paths, paper.image_path, model=model_vison, lang=lang)
+        if prompt_session:
+            with open(f'{out_path}/image_parse.json', 'w') as f:
+                json.dump(prompt_session, f, indent=4, ensure_ascii=False)
+            summary_chunks = mul_modal_chunk(prompt_session, paper.directory)
+        else:
+            summary_chunks = []
+        text_chunks = merge_chunks(text_content.split('\n\n'))
+        chunks = text_chunks + summary_chunks
+        chunks_not_empty = []
+        for i in chunks:
+            i = i.strip()
+            if i:
+                chunks_not_empty.append(i)
+        content = '\n\n'.join(chunks_not_empty)
+        with open(f'{out_path}/chunks.txt', 'w', encoding='utf-8') as file:
+            file.write(content)
+        return content
 
-    # 3.2 level 1
-    max_tokens = 12288
+    async def rag_stage(content):
+        async with RAG_LOCK:
+            rag = await initialize_rag(db_path)
+            if not is_rag:
+                await rag_insert(rag, content)
+        return rag
 
     # 3.2.1
-    cohort_info = await cohort_agent(content=content, model=model_agent, lang=lang, max_tokens=max_tokens, rag=None)
-    print('cohort:', cohort_info)
-    with open(f'{out_path}/cohort_info.json', 'w', encoding='utf-8') as file:
-        json.dump(cohort_info, file, indent=4, ensure_ascii=False)
+    async def cohort_stage(content):
+        cohort_info = await cohort_agent(
+            content=content, model=model_agent, lang=lang, max_tokens=max_tokens, rag=None)
+        print('cohort:', cohort_info)
+        save('cohort_info.json', cohort_info)
+        return cohort_info
 
     # 3.2.2-4
-    outcome_info = await outcome_agent(content=content, model=model_agent, lang=lang, max_tokens=max_tokens, rag=None)
-    print('info:', outcome_info)
-    with open(f'{out_path}/outcome_info.json', 'w', encoding='utf-8') as file:
-        json.dump(outcome_info, file, indent=4, ensure_ascii=False)
+    async def outcome_stage(content):
+        outcome_info = await outcome_agent(
+            content=content, model=model_agent, lang=lang, max_tokens=max_tokens, rag=None)
+        print('info:', outcome_info)
+        save('outcome_info.json', outcome_info)
+        return outcome_info
 
     # 3.2.2.1
-    cancer_content = outcome_info['Outcome']
-    risk_factor_content = outcome_info['Risk Factors']
-    if not risk_factor_content:
-        risk_factor_content = ['本文主要致癌风险因素']
-    abs_path = os.path.split(os.path.realpath(__file__))[0]
-    cancer_list = await cancer_agent(content=cancer_content, abs_path=abs_path, model=model_agent, lang=lang,
-                                     max_tokens=max_tokens)
-    print('cancer:', cancer_list)
-    with open(f'{out_path}/cancer_adj.json', 'w', encoding='utf-8') as file:
-        json.dump(cancer_list, file, indent=4, ensure_ascii=False)
-    risk_factor_list = await risk_factor_agent(content=risk_factor_content, abs_path=abs_path, model=model_agent, lang=lang,
-                                               max_tokens=max_tokens)
-    print('risk factor:', risk_factor_list)
-    with open(f'{out_path}/risk_factor_adj.json', 'w', encoding='utf-8') as file:
-        json.dump(risk_factor_list, file, indent=4, ensure_ascii=False)
+    async def cancer_stage(outcome_info):
+        cancer_list = await cancer_agent(content=outcome_info['Outcome'], abs_path=abs_path, model=model_agent, lang=lang,
+                                         max_tokens=max_tokens)
+        print('cancer:', cancer_list)
+        save('cancer_adj.json', cancer_list)
+        return cancer_list
+
+    async def risk_factor_stage(outcome_info):
+        risk_factor_list = await risk_factor_agent(content=risk_factors(outcome_info), abs_path=abs_path,
+                                                   model=model_agent, lang=lang, max_tokens=max_tokens)
+        print('risk factor:', risk_factor_list)
+        save('risk_factor_adj.json', risk_factor_list)
+        return risk_factor_list
 
     # 3.2
-    risk_stimate = outcome_info['RiskEstimate']
-    design = outcome_info['Design']
-    group_dict = {}
-    for cid, cinfo in cancer_content.items():
-        for risk_factor in risk_factor_content:
+    async def group_stage(cohort_info, outcome_info, rag, content=None, cancer=None, risk_factor=None, theme=None):
+        cancer_content = outcome_info['Outcome']
+        risk_factor_content = risk_factors(outcome_info)
+        pruned = set()
+        if prune:
+            summaries = [chunk for chunk in content.split('\n\n') if chunk.lstrip().startswith('<summary of')]
+            pair_status = check_pairs(text_content, summaries, cancer_content, risk_factor_content, cancer, risk_factor,
+                                      os.path.join(abs_path, 'lib'))
+            save('pair_pruning.json', pair_status)
+            pruned = {pair for pair, status in pair_status.items() if status['status'] == 'pruned'}
+            not_found = sum(status['status'] == 'not_found' for status in pair_status.values())
+            print(f'{paper.base_name}: kept {len(pair_status) - len(pruned)} of {len(pair_status)} pairs, '
+                  f'pruned {len(pruned)} ({not_found} not found, kept).')
+        risk_stimate = outcome_info['RiskEstimate']
+        design = outcome_info['Design']
+        cohort = json.dumps(cohort_info, ensure_ascii=False)
+        cohort_id = ', '.join(cohort_info.keys())
+
+        async def group_pair(cinfo, risk_factor):
             cancer = cinfo['Name']
-            import nest_asyncio
-            nest_asyncio.apply()
-            raw_chunk = rag.query(
-                f"「{cancer}」和「{risk_factor}」的分组信息、人数信息、方法、结果、图表？",
-                param=QueryParam(mode='mix', top_k=10, only_need_context=True)
-            )
-            kg_context = raw_chunk.get('kg_context', '')
-            if not kg_context:
-                kg_context = ''
-            vector_context = raw_chunk.get('vector_context', '')
-            if not vector_context:
-                vector_context = ''
-            chunk = f'{kg_context}\n\n{vector_context}'
-            cohort = json.dumps(cohort_info, ensure_ascii=False)
-            cohort_id = ', '.join(cohort_info.keys())
-            group_info = await group_agent(
+            chunk = await rag_context(rag, f"「{cancer}」和「{risk_factor}」的分组信息、人数信息、方法、结果、图表？")
+            return await group_agent(
                 chunk=chunk, outcome=cancer, risk_Factors=risk_factor, cohort=cohort, risk_class=risk_stimate,
                 cohort_id=cohort_id, design=design, model=model_agent, lang=lang, max_tokens=max_tokens)
-            group_dict[f'{cid}:{risk_factor}'] = group_info
-    with open(f'{out_path}/group_info.json', 'w', encoding='utf-8') as file:
-        json.dump(group_dict, file, indent=4, ensure_ascii=False)
-    # print(group_dict)
+
+        # every pair at once, the requests are paced by the rate limiter of model_agent
+        pairs = [(cid, cinfo, risk_factor) for cid, cinfo in cancer_content.items()
+                 for risk_factor in risk_factor_content if f'{cid}:{risk_factor}' not in pruned]
+        results = await asyncio.gather(
+            *[group_pair(cinfo, risk_factor) for _, cinfo, risk_factor in pairs], return_exceptions=True)
+        results = dict(zip([f'{cid}:{risk_factor}' for cid, _, risk_factor in pairs], results))
+        # pruned pairs stay in the grid, marked as such
+        group_dict = {}
+        for cid in cancer_content:
+            for risk_factor in risk_factor_content:
+                key = f'{cid}:{risk_factor}'
+                group_info = results.get(key, {"Run status": "Pruned",
+                                               "Error message": "not mentioned together in the results"})
+                if isinstance(group_info, Exception):
+                    print(f'{paper.base_name}: group extraction failed for {key}: {group_info}')
+                    group_info = {"Run status": "System Error", "Error message": str(group_info)}
+                group_dict[key] = group_info
+        save('group_info.json', group_dict)
+        return group_dict
+
+    # theme and grade only need the text, cancer and risk factors only need the outcomes
+    stages = {
+        'content': (content_stage, []),
+        'rag': (rag_stage, ['content']),
+        'cohort_info': (cohort_stage, ['content']),
+        'outcome_info': (outcome_stage, ['content']),
+        'cancer': (cancer_stage, ['outcome_info']),
+        'risk_factor': (risk_factor_stage, ['outcome_info']),
+        'group': (group_stage, ['cohort_info', 'outcome_info', 'rag']),
+    }
+    if prune:
+        # pairs are checked against the names normalised by the cancer and risk factor agents
+        stages['group'] = (group_stage, ['cohort_info', 'outcome_info', 'rag', 'content', 'cancer', 'risk_factor'])
+    if theme:
+        stages['theme'] = (theme_stage, [])
+        # the N x M group calls only start for papers about cancer risk
+        stages['group'][1].append('theme')
+    if grade:
+        stages['grade'] = (grade_stage, [])
+    try:
+        await run_stages(stages)
+    except GateClosed as e:
+        # a rejected paper keeps only its parsed text, as when theme ran before the other agents
+        for file_name in saved:
+            if os.path.exists(f'{out_path}/{file_name}'):
+                os.remove(f'{out_path}/{file_name}')
+        print(f'{paper.base_name}: paper is not related to cancer risk.')
+        print(e.result)
+        return 'rejected'
+    return 'done'
+
+
+def risk_factors(outcome_info):
+    return outcome_info['Risk Factors'] or ['本文主要致癌风险因素']
+
+
+def find_papers(input_path):
+    """
+    :param input_path: directory of MinerU outputs, or a manifest file with one paper directory per line
+    :return: list of (name, paper directory), the name is the base name of the directory
+    """
+    if os.path.isdir(input_path):
+        dirs = [os.path.join(input_path, name) for name in sorted(os.listdir(input_path))]
+        dirs = [d for d in dirs if os.path.isfile(os.path.join(d, 'auto', f'{os.path.basename(d)}.md'))]
+    else:
+        with open(input_path, encoding='utf-8') as f:
+            dirs = [line.split('\t')[0].strip() for line in f if line.strip()]
+    papers = [(os.path.basename(d.rstrip('/')), d) for d in dirs]
+    names = [name for name, _ in papers]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        sys.exit(f'Papers with the same directory name: {", ".join(duplicates)}')
+    return papers
+
+
+def load_status(status_file):
+    """
+    :return: dict of paper name -> last status in `status_file`
+    """
+    if not os.path.exists(status_file):
+        return {}
+    with open(status_file, encoding='utf-8') as f:
+        return {row[0]: row[1] for row in csv.reader(f, delimiter='\t') if len(row) > 1}
+
+
+async def run_batch(args):
+    """
+    Process the papers of `args.input_dir` with `args.papers_in_flight` workers sharing the LLM clients, rate
+    limiters and cache, writing each paper into `args.out_dir`/name and its status into `STATUS_FILE`.
+    """
+    papers = find_papers(args.input_dir)
+    os.makedirs(args.out_dir, exist_ok=True)
+    status_file = os.path.join(args.out_dir, STATUS_FILE)
+    finished = load_status(status_file) if args.resume else {}
+    todo = [(name, d) for name, d in papers if finished.get(name) not in ('done', 'rejected')]
+    print(f'{len(papers)} papers, {len(todo)} to process.')
+    pending = iter(todo)
+    counts = {}
+
+    with open(status_file, 'a' if args.resume else 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+
+        async def work():
+            for name, input_dir in pending:
+                out_path = os.path.join(args.out_dir, name)
+                os.makedirs(out_path, exist_ok=True)
+                rag_dir = os.path.join(args.rag_dir, name) if args.rag_dir else ''
+                if rag_dir and not os.path.isdir(rag_dir):
+                    rag_dir = ''
+                start = time.time()
+                message = ''
+                try:
+                    status = await process_paper(input_dir, out_path, rag_dir, args.theme_class, args.grade, args.lang,
+                                                  args.prune_pairs)
+                except Exception as e:
+                    status, message = 'error', f'{type(e).__name__}: {e}' if str(e) else type(e).__name__
+                    print(f'{name}: failed, {message}')
+                writer.writerow([name, status, f'{time.time() - start:.1f}', ' '.join(message.split())])
+                f.flush()
+                counts[status] = counts.get(status, 0) + 1
+
+        await asyncio.gather(*[work() for _ in range(args.papers_in_flight)])
+    print(f'batch: {", ".join(f"{n} {status}" for status, n in sorted(counts.items()))} ({status_file}).')
+
+
+async def main():
+    args = get_args()
+    if args.batch:
+        await run_batch(args)
+        return
+    await process_paper(args.input_dir, args.out_dir, args.rag_dir, args.theme_class, args.grade, args.lang,
+                        args.prune_pairs)
+
+
+async def run():
+    try:
+        await main()
+    finally:
+        await close_clients()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(run())
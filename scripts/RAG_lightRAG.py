@@ -8,6 +8,7 @@ from lightrag import LightRAG, QueryParam
 from lightrag.kg.shared_storage import initialize_pipeline_status
 from lightrag.llm.openai import openai_complete_if_cache, openai_embed
 from .llm_info import model_embed, model_rag, api_key, chat_base_url
+from .rate_limit import get_limiter, text_tokens, is_rate_limited, retry_after
 from lightrag.utils import setup_logger
 
 setup_logger("lightrag", level="INFO")
@@ -17,10 +18,30 @@ entities = ["Cancers", "Risk Factors", "Risk Values", "Cohort Information", "Adj
             "References", "Methods", "Results", "Discussion", "Conclusion", "Acknowledgments", 'Author Information']
 
 
+async def limited(model, estimated, func, *args, **kwargs):
+    """
+    Send a LightRAG request through the shared limiter of `model`, pausing it on a 429 (LightRAG retries).
+    :param estimated: estimated tokens of the request
+    :param func: async function sending the request, called with `args` and `kwargs`
+    """
+    limiter = get_limiter(model)
+    await limiter.acquire(estimated)
+    try:
+        return await func(*args, **kwargs)
+    except Exception as e:
+        if is_rate_limited(e):
+            limiter.pause(retry_after(e))
+        raise
+
+
 async def llm_model_func(
         prompt, system_prompt=None, history_messages=[], keyword_extraction=False, **kwargs
 ) -> str:
-    return await openai_complete_if_cache(
+    # LightRAG does not return the usage, the completion is counted from its text
+    texts = [prompt, system_prompt or ''] + [str(message.get('content', '')) for message in history_messages]
+    estimated = sum(text_tokens(text) for text in texts) + 1024
+    response = await limited(
+        model_rag, estimated, openai_complete_if_cache,
         model_rag,
         prompt,
         system_prompt=system_prompt,
@@ -29,10 +50,14 @@ async def llm_model_func(
         base_url=chat_base_url,
         **kwargs
     )
+    if isinstance(response, str):
+        get_limiter(model_rag).record(estimated - 1024 + text_tokens(response), estimated)
+    return response
 
 
 async def embedding_func(texts: list[str]) -> np.ndarray:
-    return await openai_embed(
+    return await limited(
+        model_embed, sum(text_tokens(text) for text in texts), openai_embed,
         texts,
         model=model_embed,
         api_key=api_key,
@@ -86,7 +111,24 @@ async def initialize_rag(WORKING_DIR):
 
     return rag
 
+async def rag_insert(rag, content, split_by_character='\n\n'):
+    """
+    Insert a paper into the RAG without blocking the event loop, its chunks are split on `split_by_character` only.
+    """
+    await rag.ainsert(content, split_by_character, True)
+
+
+async def rag_context(rag, query, mode='mix', top_k=10):
+    """
+    :return: retrieved knowledge graph and vector context of `query`, without the LLM answer
+    """
+    raw_chunk = await rag.aquery(query, param=QueryParam(mode=mode, top_k=top_k, only_need_context=True))
+    if isinstance(raw_chunk, dict):
+        return f"{raw_chunk.get('kg_context') or ''}\n\n{raw_chunk.get('vector_context') or ''}"
+    return raw_chunk or ''
+
+
 async def rag_search(rag, query, mode="hybrid", top_k=5):
-    chunks = rag.query(query, param=QueryParam(mode=mode, top_k=top_k, only_need_prompt=True))
+    chunks = await rag.aquery(query, param=QueryParam(mode=mode, top_k=top_k, only_need_prompt=True))
     chunks = chunks.split('---Data Sources---')[1].split('---Response Requirements---')[0].strip()
-    return chunks
\ No newline at end of file
+    return chunks
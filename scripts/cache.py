@@ -0,0 +1,109 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from .llm_info import cache_path, cache_max_size_mb, cache_max_age_days, cache_bypass
+
+_cache = None
+
+
+class ResponseCache:
+    def __init__(self, path, max_size_mb=1024, max_age_days=90, evict_every=1000):
+        """
+        Content-addressed store of parsed LLM responses in SQLite.
+        :param path: sqlite file, created if missing
+        :param max_size_mb: least recently used entries are evicted above this size
+        :param max_age_days: entries older than this are evicted
+        :param evict_every: run eviction after this many writes
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_size = max_size_mb * 1024 * 1024
+        self.max_age = max_age_days * 86400
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+            'created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.evict()
+
+    @staticmethod
+    def make_key(model, messages, **params):
+        """
+        Key of a request: sha256 of model, messages and sampling parameters.
+        """
+        raw = json.dumps({'model': model, 'messages': messages, 'params': params}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        row = self.conn.execute('SELECT value, created FROM responses WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row is None or now - row[1] > self.max_age:
+            self.misses += 1
+            return None
+        self.conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        raw = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+            (key, raw, len(raw.encode('utf-8')), now, now)
+        )
+        self.writes += 1
+        if self.writes % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Drop expired entries, then least recently used ones until the cache fits `max_size_mb`.
+        """
+        self.conn.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.max_age,))
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_size:
+            return
+        excess = total - self.max_size
+        keys = []
+        for key, size in self.conn.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+
+    def close(self):
+        print(f'LLM cache: {self.hits} hits, {self.misses} misses, {self.writes} writes ({self.path})')
+        self.conn.close()
+
+
+def get_cache():
+    """
+    Return the process-wide response cache, or None when `cache_bypass` is set in llm_info.
+    """
+    global _cache
+    if cache_bypass:
+        return None
+    if _cache is None:
+        _cache = ResponseCache(cache_path, cache_max_size_mb, cache_max_age_days)
+    return _cache
+
+
+def close_cache():
+    global _cache
+    if _cache is not None:
+        _cache.close()
+        _cache = None
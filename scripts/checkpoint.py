@@ -0,0 +1,126 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import os
+import csv
+import json
+import time
+
+
+def is_error(response):
+    return str(response.get('Result', '')).startswith('Error:')
+
+
+class PeriodicSync:
+    def __init__(self, file, interval=5.0, every=100):
+        """
+        Flush after each write and fsync a file at most every `interval` seconds or `every` records.
+        """
+        self.file = file
+        self.interval = interval
+        self.every = every
+        self._pending = 0
+        self._last = time.monotonic()
+
+    def tick(self):
+        self.file.flush()
+        self._pending += 1
+        now = time.monotonic()
+        if self._pending >= self.every or now - self._last >= self.interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._pending = 0
+        self._last = time.monotonic()
+
+
+class Journal:
+    def __init__(self, path):
+        """
+        Append-only jsonl sidecar of finished results ({"session_id": ..., "response": {...}} per line).
+        :param path: journal file, usually `<output>.journal`
+        """
+        self.path = path
+        self._file = None
+        self._sync = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self, retry_errors=False):
+        """
+        Results of earlier runs keyed by str(session_id); the last line of an id wins.
+        :param retry_errors: leave out results whose `Result` is `Error:...` so they are submitted again
+        """
+        completed = {}
+        if not self.exists():
+            return completed
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line of a crashed run may be truncated
+                    continue
+                completed[str(record['session_id'])] = record['response']
+        if retry_errors:
+            completed = {k: v for k, v in completed.items() if not is_error(v)}
+        return completed
+
+    def append(self, session_id, response):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._sync = PeriodicSync(self._file)
+            if self._file.tell() and not self._ends_with_newline():
+                self._file.write('\n')
+        record = {'session_id': session_id, 'response': response}
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        self._sync.tick()
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def close(self):
+        if self._file is not None:
+            self._sync.sync()
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """
+        Delete the journal once the final output is written, so a rerun without --resume does not find it.
+        """
+        self.close()
+        if self.exists():
+            os.remove(self.path)
+
+
+def load_completed_tsv(path, result_index, retry_errors=False):
+    """
+    Ids already written to a headerless result tsv (stream mode output). With `retry_errors` the rows whose result
+    column starts with `Error:` are removed from the file, so they can be screened again and appended.
+    :param path: result tsv
+    :param result_index: column index of `Result`
+    :return: set of str(session_id)
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    tmp_path = f'{path}.tmp'
+    with open(path, newline='', encoding='utf-8') as f, open(tmp_path, 'w', newline='', encoding='utf-8') as out:
+        writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+        for row in csv.reader(f, delimiter='\t'):
+            if not row:
+                continue
+            if len(row) <= result_index:
+                # truncated last row of a crashed run
+                continue
+            if retry_errors and row[result_index].startswith('Error:'):
+                continue
+            completed.add(row[0])
+            writer.writerow(row)
+    os.replace(tmp_path, path)
+    return completed
@@ -0,0 +1,118 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import time
+import asyncio
+from .rate_limit import is_rate_limited
+
+
+def is_timeout(e):
+    return isinstance(e, (asyncio.TimeoutError, TimeoutError)) or 'timeout' in type(e).__name__.lower()
+
+
+class AdaptiveConcurrency:
+    def __init__(self, initial, maximum, minimum=1, increase=1.0, decrease=0.5, latency_factor=2.0,
+                 max_error_rate=0.1, report_interval=30, name='requests'):
+        """
+        AIMD limit on in-flight requests. The window grows by `increase` per window of healthy requests and is
+        multiplied by `decrease` on a 429 or timeout (at most once per observed latency, so a burst of failures
+        counts as one congestion signal).
+        :param initial: starting window
+        :param maximum: upper bound of the window
+        :param minimum: lower bound of the window
+        :param increase: additive step per window of healthy requests
+        :param decrease: multiplicative factor on throttling
+        :param latency_factor: a request slower than `latency_factor` x baseline latency does not grow the window
+        :param max_error_rate: the window does not grow while the smoothed error rate is above this
+        :param report_interval: seconds between progress lines, 0 to disable
+        :param name: label of the progress lines
+        """
+        self.window = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.max_error_rate = max_error_rate
+        self.report_interval = report_interval
+        self.name = name
+        self.in_flight = 0
+        self.completed = 0
+        self.errors = 0
+        self.throttled = 0
+        self._baseline = None
+        self._error_rate = 0.0
+        self._last_decrease = 0.0
+        self._started = time.monotonic()
+        self._last_report = self._started
+        self._last_completed = 0
+        self._condition = asyncio.Condition()
+
+    def request(self):
+        """
+        Context manager holding one slot for the duration of a single API call.
+        """
+        return _Slot(self)
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.window))
+            self.in_flight += 1
+
+    async def release(self, latency, error=None):
+        async with self._condition:
+            self.in_flight -= 1
+            self._update(latency, error)
+            self._condition.notify(max(int(self.window) - self.in_flight, 0))
+        self._report()
+
+    def _update(self, latency, error):
+        self.completed += 1
+        now = time.monotonic()
+        if error is not None:
+            self.errors += 1
+            self._error_rate = 0.95 * self._error_rate + 0.05
+            if is_rate_limited(error) or is_timeout(error):
+                self.throttled += 1
+                if now - self._last_decrease > (self._baseline or 1.0):
+                    self.window = max(self.minimum, self.window * self.decrease)
+                    self._last_decrease = now
+            return
+        self._error_rate = 0.95 * self._error_rate
+        if self._baseline is None:
+            self._baseline = latency
+        healthy = latency <= self.latency_factor * self._baseline and self._error_rate <= self.max_error_rate
+        self._baseline = 0.95 * self._baseline + 0.05 * latency
+        if healthy:
+            self.window = min(self.maximum, self.window + self.increase / self.window)
+
+    def _report(self):
+        now = time.monotonic()
+        if not self.report_interval or now - self._last_report < self.report_interval:
+            return
+        throughput = (self.completed - self._last_completed) / (now - self._last_report)
+        self._last_report = now
+        self._last_completed = self.completed
+        print(f'[{self.name}] window={self.window:.1f} in_flight={self.in_flight} '
+              f'throughput={throughput:.2f}/s completed={self.completed} errors={self.errors} '
+              f'throttled={self.throttled}')
+
+    def summary(self):
+        elapsed = time.monotonic() - self._started
+        print(f'[{self.name}] finished {self.completed} requests in {elapsed:.0f}s '
+              f'({self.completed / max(elapsed, 1e-9):.2f}/s), errors={self.errors}, throttled={self.throttled}, '
+              f'final window={self.window:.1f}')
+
+
+class _Slot:
+    def __init__(self, controller):
+        self.controller = controller
+        self.start = 0.0
+
+    async def __aenter__(self):
+        await self.controller.acquire()
+        self.start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.controller.release(time.monotonic() - self.start, exc)
+        return False
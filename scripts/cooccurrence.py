@@ -0,0 +1,159 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import os
+import re
+import pandas as pd
+from functools import lru_cache
+from .sections import split_blocks, is_table
+
+# paragraphs of these sections report results, tables count wherever they are
+RESULT_SECTIONS = ('front', 'abstract', 'results', 'conclusion')
+# words removed to get the core of a name, e.g. "lung cancer" -> "lung", "alcohol use" -> "alcohol"
+_cancer_generic = re.compile(
+    r'\b(cancers?|carcinomas?|tumou?rs?|neoplasms?|malignanc(y|ies)|incidence|risk of)\b|癌症|肿瘤', re.IGNORECASE)
+_risk_factor_generic = re.compile(
+    r'^(occupational )?exposure to |^diet (high|low) in |\b(use|intake|consumption|exposure)\b', re.IGNORECASE)
+_cjk = re.compile(r'[\u3400-\u9fff]')
+
+
+def _normalize(text):
+    return ' '.join(str(text).lower().split())
+
+
+@lru_cache(maxsize=None)
+def term_pattern(term):
+    """
+    :return: regex matching a Latin-script term as whole words (plural allowed), e.g. "lip" but not "lipid", or None
+             for a CJK term, matched as a substring since CJK text has no word boundaries
+    """
+    if _cjk.search(term):
+        return None
+    return re.compile(rf'(?<!\w){re.escape(term)}s?(?!\w)')
+
+
+def mentions(unit, term):
+    pattern = term_pattern(term)
+    return term in unit if pattern is None else bool(pattern.search(unit))
+
+
+def variants(name, generic):
+    """
+    :return: the normalized name and its core without `generic` words, if at least 3 characters long
+    """
+    name = _normalize(name)
+    core = _normalize(generic.sub(' ', name))
+    return {term for term in (name, core) if len(term) >= 3}
+
+
+@lru_cache()
+def load_synonyms(lib_dir):
+    """
+    :return: (cancer id -> names from lib/cancers.tsv, risk factor id -> English and Chinese names from
+             lib/risk_factors.tsv), ids are strings as answered by cancer_agent and risk_factor_agent
+    """
+    cancers = pd.read_table(os.path.join(lib_dir, 'cancers.tsv'), index_col=0)
+    cancer_names = {
+        str(i): [part for part in re.split(r',| and | excl\. ', name) if part.strip()]
+        for i, name in cancers['Cancer types'].items()
+    }
+    risk_factors = pd.read_table(os.path.join(lib_dir, 'risk_factors.tsv'))
+    risk_factor_names = {
+        str(i): [name for name in str(level).split('\n') + [str(name)] if name.strip()]
+        for i, level, name in zip(risk_factors['ID'], risk_factors['level 2'], risk_factors['risk factor'])
+    }
+    return cancer_names, risk_factor_names
+
+
+def terms_of(name, answer, synonyms, generic):
+    """
+    :param name: name extracted from the paper
+    :param answer: answer of the normalization agent for this name, e.g. {'id': '32, 33'}, or None
+    :param synonyms: id -> names of the lib table
+    :return: search terms of the name and of the lib entries it was matched to
+    """
+    terms = variants(name, generic)
+    ids = str((answer or {}).get('id', '')) if isinstance(answer, dict) else ''
+    for i in ids.split(','):
+        i = i.strip()
+        # an id missing from the table is a name defined by the agent
+        for synonym in synonyms.get(i, [i] if i else []):
+            terms |= variants(synonym, generic)
+    return terms
+
+
+def by_position(answer, count):
+    """
+    The agents number their answers ("cancer 1", "risk 1"...) in input order.
+    :return: list of `count` answers, or of None when they can not be aligned
+    """
+    if not isinstance(answer, dict) or 'Run status' in answer:
+        return [None] * count
+    values = list(answer.values())
+    return values if len(values) == count else [None] * count
+
+
+class CooccurrenceIndex:
+    def __init__(self, text, extra_units=()):
+        """
+        Index the parts of a paper that report results: paragraphs of `RESULT_SECTIONS`, tables with the paragraphs
+        around them (caption, footnotes) and `extra_units`, such as the table and figure summaries.
+        :param text: MinerU markdown of the paper
+        """
+        blocks = split_blocks(text)
+        units = []
+        for i, (_, category, is_heading, block) in enumerate(blocks):
+            if is_heading:
+                continue
+            if is_table(block):
+                units.append('\n'.join(b[3] for b in blocks[max(i - 1, 0):i + 2]))
+            elif category in RESULT_SECTIONS:
+                units.append(block)
+        self.units = [_normalize(unit) for unit in units + list(extra_units)]
+
+    def find(self, terms):
+        return {i for i, unit in enumerate(self.units) if any(mentions(unit, term) for term in terms)}
+
+    def check(self, cancer_terms, risk_factor_terms):
+        """
+        :return: dict with `status`: `kept` if both are mentioned in the same unit, `pruned` if both are found but
+                 never together, `not_found` if one of them is not found (kept, it may be written differently),
+                 and the number of units mentioning the cancer, the risk factor and both
+        """
+        cancer_units = self.find(cancer_terms)
+        risk_factor_units = self.find(risk_factor_terms)
+        together = cancer_units & risk_factor_units
+        if not cancer_units or not risk_factor_units:
+            status = 'not_found'
+        else:
+            status = 'kept' if together else 'pruned'
+        return {'status': status, 'cancer_units': len(cancer_units), 'risk_factor_units': len(risk_factor_units),
+                'together': len(together)}
+
+
+def check_pairs(text, summaries, cancer_content, risk_factor_content, cancer_list, risk_factor_list, lib_dir):
+    """
+    Check which cancer × risk factor pairs are reported together in the results of a paper.
+    :param text: MinerU markdown of the paper
+    :param summaries: table and figure summary chunks
+    :param cancer_content: outcomes of outcome_agent, dict of id -> {'Name': ...}
+    :param risk_factor_content: list of risk factor names
+    :param cancer_list: answer of cancer_agent for `cancer_content`
+    :param risk_factor_list: answer of risk_factor_agent for `risk_factor_content`
+    :param lib_dir: directory of cancers.tsv and risk_factors.tsv
+    :return: dict of 'cancer id:risk factor' -> result of `CooccurrenceIndex.check`
+    """
+    cancer_names, risk_factor_names = load_synonyms(lib_dir)
+    index = CooccurrenceIndex(text, summaries)
+    cancer_terms = [
+        terms_of(cinfo.get('Name', ''), answer, cancer_names, _cancer_generic)
+        for cinfo, answer in zip(cancer_content.values(), by_position(cancer_list, len(cancer_content)))
+    ]
+    risk_factor_terms = [
+        terms_of(risk_factor, answer, risk_factor_names, _risk_factor_generic)
+        for risk_factor, answer in zip(risk_factor_content, by_position(risk_factor_list, len(risk_factor_content)))
+    ]
+    pairs = {}
+    for cid, terms in zip(cancer_content, cancer_terms):
+        for risk_factor, rf_terms in zip(risk_factor_content, risk_factor_terms):
+            pairs[f'{cid}:{risk_factor}'] = index.check(terms, rf_terms)
+    return pairs
@@ -0,0 +1,71 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import time
+import asyncio
+
+
+class GateClosed(Exception):
+    def __init__(self, stage, result):
+        """
+        Raised by a gate stage to cancel the stages that are still pending.
+        :param stage: name of the gate
+        :param result: result of the gate, e.g. the rejecting answer
+        """
+        super().__init__(f'{stage} gate closed')
+        self.stage = stage
+        self.result = result
+
+
+def check_stages(stages):
+    """
+    :param stages: dict of name -> (coroutine function, list of dependency names)
+    :raise ValueError: on an unknown dependency or a cycle
+    """
+    for name, (_, deps) in stages.items():
+        for dep in deps:
+            if dep not in stages:
+                raise ValueError(f'stage {name} depends on unknown stage {dep}')
+    done = set()
+    while len(done) < len(stages):
+        ready = [name for name, (_, deps) in stages.items() if name not in done and all(d in done for d in deps)]
+        if not ready:
+            raise ValueError(f'dependency cycle between {", ".join(sorted(set(stages) - done))}')
+        done.update(ready)
+
+
+async def run_stages(stages, timings=None):
+    """
+    Run async stages as soon as the stages they depend on are finished, so independent stages run concurrently and
+    the wall time is about the one of the critical path. The first exception (e.g. `GateClosed`) cancels every stage
+    still pending or running and is raised.
+    :param stages: dict of name -> (coroutine function, list of dependency names), the function is called with the
+                   results of its dependencies as keyword arguments
+    :param timings: optional dict, filled with name -> (start, end) in seconds since the start of the run
+    :return: dict of name -> result
+    """
+    check_stages(stages)
+    tasks = {}
+    start = time.monotonic()
+
+    async def run(name, func, deps):
+        inputs = {dep: await tasks[dep] for dep in deps}
+        begin = time.monotonic() - start
+        result = await func(**inputs)
+        if timings is not None:
+            timings[name] = (round(begin, 2), round(time.monotonic() - start, 2))
+        return result
+
+    for name, (func, deps) in stages.items():
+        tasks[name] = asyncio.create_task(run(name, func, deps))
+    try:
+        await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_EXCEPTION)
+        # dependents of a failed stage fail with the same exception, a closed gate wins over other errors
+        errors = [task.exception() for task in tasks.values()
+                  if task.done() and not task.cancelled() and task.exception()]
+        if errors:
+            raise ([e for e in errors if isinstance(e, GateClosed)] or errors)[0]
+        return {name: task.result() for name, task in tasks.items()}
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
@@ -0,0 +1,136 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import re
+import hashlib
+import unicodedata
+import numpy as np
+
+_mersenne_prime = np.uint64((1 << 61) - 1)
+_max_hash = np.uint64((1 << 32) - 1)
+
+
+def normalize_text(text):
+    """
+    Case, width, punctuation and whitespace insensitive form of an abstract.
+    """
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    text = re.sub(r'[^\w\s]|_', ' ', text)
+    return ' '.join(text.split())
+
+
+def text_hash(text):
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class MinHashLSH:
+    def __init__(self, threshold=0.9, num_perm=64, bands=16, shingle=5, seed=1):
+        """
+        MinHash signatures over character shingles, indexed with LSH banding.
+        :param threshold: estimated Jaccard similarity above which two texts are near duplicates
+        :param num_perm: number of hash permutations (signature length)
+        :param bands: LSH bands, `num_perm` must be divisible by it
+        :param shingle: character shingle length (works for English and Chinese alike)
+        """
+        assert num_perm % bands == 0
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = {}
+
+    def signature(self, normalized):
+        text = normalized.replace(' ', '')
+        shingles = {text[i:i + self.shingle] for i in range(max(len(text) - self.shingle + 1, 1))}
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little') for s in shingles],
+            dtype=np.uint64
+        )
+        permuted = np.bitwise_and((np.outer(hashes, self._a) + self._b) % _mersenne_prime, _max_hash)
+        return permuted.min(axis=0)
+
+    def query(self, signature):
+        """
+        Key of an indexed text whose estimated similarity with `signature` reaches the threshold, or None.
+        """
+        candidates = set()
+        for band, buckets in enumerate(self._buckets):
+            candidates.update(buckets.get(self._band_key(signature, band), ()))
+        best, best_similarity = None, self.threshold
+        for key in candidates:
+            similarity = float(np.mean(self._signatures[key] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = key, similarity
+        return best
+
+    def insert(self, key, signature):
+        self._signatures[key] = signature
+        for band, buckets in enumerate(self._buckets):
+            buckets.setdefault(self._band_key(signature, band), []).append(key)
+
+    def _band_key(self, signature, band):
+        return signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+
+class Deduplicator:
+    def __init__(self, near_threshold=0.0):
+        """
+        Map every abstract to the first session carrying the same (or a nearly identical) text.
+        :param near_threshold: MinHash similarity for near duplicates, 0 to only merge exact duplicates
+        """
+        self.lsh = MinHashLSH(near_threshold) if near_threshold else None
+        self._representatives = {}
+        self._ids = {}
+        self.total = 0
+        self.exact = 0
+        self.near = 0
+        self.conflicting_ids = 0
+
+    def add(self, session_id, text):
+        """
+        :return: (representative session id, True if this text is new and must be screened)
+        """
+        self.total += 1
+        normalized = normalize_text(text)
+        digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+        previous = self._ids.setdefault(str(session_id), digest)
+        if previous != digest:
+            self.conflicting_ids += 1
+        representative = self._representatives.get(digest)
+        if representative is not None:
+            self.exact += 1
+            return representative, False
+        if self.lsh is not None:
+            signature = self.lsh.signature(normalized)
+            representative = self.lsh.query(signature)
+            if representative is not None:
+                self.near += 1
+                self._representatives[digest] = representative
+                return representative, False
+            self.lsh.insert(session_id, signature)
+        self._representatives[digest] = session_id
+        return session_id, True
+
+    def split(self, sessions):
+        """
+        :param sessions: iterable of (session_id, abstract)
+        :return: (dict of distinct sessions to screen, dict of duplicate session_id -> representative session_id)
+        """
+        distinct, duplicates = {}, {}
+        for session_id, text in sessions:
+            representative, new = self.add(session_id, text)
+            if new:
+                distinct[session_id] = text
+            elif representative != session_id:
+                duplicates[session_id] = representative
+        return distinct, duplicates
+
+    def report(self):
+        distinct = self.total - self.exact - self.near
+        print(f'dedup: {self.total} abstracts, {distinct} distinct, {self.exact} exact and {self.near} near '
+              f'duplicates, {self.exact + self.near} LLM calls saved.')
+        if self.conflicting_ids:
+            print(f'dedup: {self.conflicting_ids} abstract ids are reused for different texts.')
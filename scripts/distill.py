@@ -0,0 +1,141 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+"""
+Local screening classifier distilled from the LLM decisions of earlier abstract screening runs.
+
+    python -m scripts.distill train -o abstract_gate.pkl screened_1.tsv screened_2.tsv
+
+The model (hashed character n-grams, tf-idf, logistic regression) runs on CPU; 1.Abstract_filter.py loads it with
+`--gate abstract_gate.pkl` and rejects the abstracts it is confident about without calling the LLM.
+Requires scikit-learn.
+"""
+import re
+import sys
+import pickle
+import pandas as pd
+from .prefilter import PreFilter
+
+DECISIONS = ('Accepted', 'Rejected')
+# `Gate` column of abstracts rejected by a DistilledGate
+GATE_PATTERN = re.compile(r'^(0\.\d{4}|1\.0000)$')
+
+
+def load_labels(tsv_files):
+    """
+    Read (abstract, decision) pairs from headerless screening outputs: column 2 is the abstract, the decision is the
+    first later column equal to Accepted/Rejected. Uncertain and failed rows, rows decided by the prefilter or a gate
+    rather than the LLM, and repeated abstracts are skipped.
+    """
+    rule_names = {rule[0] for rule in PreFilter().rules}
+    texts, labels, seen = [], [], set()
+    for file_name in tsv_files:
+        df = pd.read_table(file_name, header=None, dtype=str, keep_default_na=False)
+        for row in df.itertuples(index=False):
+            text = row[1]
+            decision = next((cell for cell in row[2:] if cell in DECISIONS), None)
+            if decision is None or not text or text in seen:
+                continue
+            if any(cell in rule_names or GATE_PATTERN.match(cell) for cell in row[2:]):
+                continue
+            seen.add(text)
+            texts.append(text)
+            labels.append(int(decision == 'Rejected'))
+    return texts, labels
+
+
+def build_pipeline():
+    from sklearn.pipeline import make_pipeline
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+    return make_pipeline(
+        # character n-grams work for English and Chinese abstracts alike
+        HashingVectorizer(analyzer='char_wb', ngram_range=(2, 4), n_features=2 ** 20, alternate_sign=False),
+        TfidfTransformer(sublinear_tf=True),
+        LogisticRegression(max_iter=1000, C=4.0),
+    )
+
+
+def threshold_report(labels, rejected_proba, thresholds=(0.5, 0.8, 0.9, 0.95, 0.98, 0.99)):
+    """
+    Print, for each threshold on P(Rejected), the share of abstracts the gate would reject, the precision and recall of
+    those rejections, and how many LLM-accepted abstracts would be lost.
+    """
+    total = len(labels)
+    rejected = sum(labels)
+    print(f'held-out: {total} abstracts, {rejected} rejected by the LLM')
+    print('threshold\tgated\tprecision\trecall\taccepted_lost')
+    for threshold in thresholds:
+        gated = [label for label, p in zip(labels, rejected_proba) if p >= threshold]
+        true_rejections = sum(gated)
+        precision = true_rejections / len(gated) if gated else 1.0
+        recall = true_rejections / rejected if rejected else 0.0
+        print(f'{threshold}\t{len(gated) / total:.1%}\t{precision:.4f}\t{recall:.4f}\t{len(gated) - true_rejections}')
+
+
+def train(tsv_files, model_path, test_size=0.2, seed=1):
+    from sklearn.model_selection import train_test_split
+    texts, labels = load_labels(tsv_files)
+    print(f'{len(texts)} labelled abstracts, {sum(labels)} rejected.')
+    train_texts, test_texts, train_labels, test_labels = train_test_split(
+        texts, labels, test_size=test_size, random_state=seed, stratify=labels)
+    pipeline = build_pipeline()
+    pipeline.fit(train_texts, train_labels)
+    threshold_report(test_labels, pipeline.predict_proba(test_texts)[:, 1])
+    # the held-out split only measures the trade-off, the saved model uses every label
+    pipeline.fit(texts, labels)
+    with open(model_path, 'wb') as f:
+        pickle.dump(pipeline, f)
+    print(f'model saved to {model_path}')
+
+
+class DistilledGate:
+    def __init__(self, model_path, threshold=0.98):
+        """
+        First-pass gate in front of the LLM: abstracts with P(Rejected) >= threshold are rejected locally.
+        :param model_path: pickle written by `train`
+        :param threshold: see the threshold table printed by `train`
+        """
+        with open(model_path, 'rb') as f:
+            self.pipeline = pickle.load(f)
+        self.threshold = threshold
+        self.checked = 0
+        self.gated = 0
+
+    def screen(self, texts, chunk_size=10000):
+        """
+        :param texts: list of abstracts, scored `chunk_size` at a time to bound the feature matrix
+        :return: one `Rejected` response or None per text
+        """
+        responses = []
+        for start in range(0, len(texts), chunk_size):
+            chunk = [str(text) for text in texts[start:start + chunk_size]]
+            for p in self.pipeline.predict_proba(chunk)[:, 1]:
+                if p >= self.threshold:
+                    self.gated += 1
+                    responses.append({'Decision': 'Rejected', 'Reason_id': 'other', 'Gate': f'{p:.4f}'})
+                else:
+                    responses.append(None)
+        self.checked += len(texts)
+        return responses
+
+    def report(self):
+        print(f'gate: rejected {self.gated} of {self.checked} abstracts locally (threshold {self.threshold}).')
+
+
+def get_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='distilled abstract screening classifier')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    train_parser = subparsers.add_parser('train', help='Train on screening outputs of 1.Abstract_filter.py.')
+    train_parser.add_argument('tsv_files', nargs='+', help='Screening output files (tsv without header).')
+    train_parser.add_argument('-o', '--output', required=True, help='Path of the serialized model.')
+    train_parser.add_argument('--test_size', type=float, default=0.2, help='Held-out share for the report.')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.command == 'train':
+        train(args.tsv_files, args.output, args.test_size)
+    sys.exit(0)
@@ -0,0 +1,384 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import time
+import asyncio
+from collections import Counter
+from .base import json_parse
+from .checkpoint import is_error
+from .llm import get_client
+from .cache import ResponseCache, get_cache
+from .concurrency import AdaptiveConcurrency
+from .rate_limit import get_limiter, estimate_tokens, is_rate_limited, retry_after, usage_tokens
+
+# added to the responses by an engine with `trace=True`
+TRACE_COLUMNS = ['Model', 'Latency', 'Tokens', 'Cache_hit']
+
+
+def needs_escalation(response):
+    return response.get('Decision') not in ('Accepted', 'Rejected')
+
+
+def majority_vote(samples, k):
+    """
+    :param samples: parsed responses of the same request, unparsed ones are counted as missing votes
+    :param k: number of samples asked for, the agreement ratio is relative to it
+    :return: response of the most frequent decision with `Votes` and `Agreement`, `Uncertain` on a tie, or None if no
+             sample has a decision
+    """
+    decisions = [s for s in samples if s.get('Decision') in ('Accepted', 'Rejected', 'Uncertain')]
+    if not decisions:
+        return None
+    counts = Counter(s['Decision'] for s in decisions).most_common()
+    decision, count = counts[0]
+    if len(counts) > 1 and counts[1][1] == count:
+        decision = 'Uncertain'
+    response = next((s for s in decisions if s['Decision'] == decision), {'Decision': decision})
+    votes = ','.join(f'{d}:{c}' for d, c in counts)
+    return dict(response, Votes=votes, Agreement=round(count / k, 2))
+
+
+def add_trace(response, earlier):
+    """
+    Add the latency and tokens of an earlier response of the same record (e.g. before escalation) to `response`.
+    """
+    if 'Latency' not in response or 'Latency' not in earlier:
+        return response
+    return dict(response, Latency=round(response['Latency'] + earlier['Latency'], 3),
+                Tokens=response['Tokens'] + earlier['Tokens'])
+
+
+def _parse(content):
+    return json_parse(' '.join(content.replace('，', ',').replace('：', ':').split()))
+
+
+def pack_sessions(sessions, pack_size, pack_tokens):
+    """
+    Group (session_id, content) pairs into lists of at most `pack_size` records and `pack_tokens` estimated tokens.
+    """
+    batch, tokens = [], 0
+    for session_id, content in sessions:
+        size = estimate_tokens([{'content': str(content)}])
+        if batch and (len(batch) >= pack_size or tokens + size > pack_tokens):
+            yield batch
+            batch, tokens = [], 0
+        batch.append((session_id, content))
+        tokens += size
+    if batch:
+        yield batch
+
+
+async def chat_completion(messages, controller, model, label, params, cycle_num=5, completion_tokens=256,
+                          validate=None, samples=False, use_cache=True, trace=None):
+    """
+    Send one screening request with caching, rate limiting and retries.
+    :param label: printed with errors
+    :param params: sampling parameters, also part of the cache key
+    :param completion_tokens: expected completion length, used by the rate limiter
+    :param validate: optional check of the parsed response, failing responses are returned but not cached
+    :param samples: parse every returned choice (`n` > 1) and return {'Samples': [parsed responses]}
+    :param use_cache: read and write the response cache
+    :param trace: optional dict, filled with `cached`, `latency` (seconds, retries included) and `tokens`
+    :return: parsed response, or {'Result': 'Error:...'} after `cycle_num` failures
+    """
+    cache = get_cache() if use_cache else None
+    cache_key = ResponseCache.make_key(model, messages, **params)
+    if trace is None:
+        trace = {}
+    trace.update(cached=False, latency=0.0, tokens=0)
+    if cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            trace['cached'] = True
+            return cached
+    client = get_client(model)
+    limiter = get_limiter(model)
+    estimated = estimate_tokens(messages, completion_tokens)
+    response = {}
+    start = time.monotonic()
+    for i in range(cycle_num):
+        try:
+            await limiter.acquire(estimated)
+            async with controller.request():
+                completion = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    **params
+                )
+            limiter.record(usage_tokens(completion), estimated)
+            trace.update(latency=time.monotonic() - start, tokens=usage_tokens(completion))
+            if samples:
+                response = {'Samples': [_parse(choice.message.content or '') for choice in completion.choices]}
+                if cache and any(response['Samples']):
+                    cache.set(cache_key, response)
+                return response
+            response = _parse(completion.choices[0].message.content)
+            if cache and response and (validate is None or validate(response)):
+                cache.set(cache_key, response)
+            return response
+        except Exception as e:
+            print(f"[{i + 1}/{cycle_num}] Error in session {label}: {e}")
+            if i + 1 == cycle_num:
+                trace['latency'] = time.monotonic() - start
+                response = {'Result': f'Error:{e}'}
+                return response
+            if is_rate_limited(e):
+                limiter.pause(retry_after(e))
+    return response
+
+
+class ScreeningEngine:
+    def __init__(self, prompt, model, name, initial_concurrency, max_concurrency, params=None, cycle_num=5,
+                 completion_tokens=256, escalate_model=None, batch_prompt=None, pack_size=1, pack_tokens=6000,
+                 prepare=None, unit='records', vote_samples=0, vote_temperature=0.7, trace=False):
+        """
+        Asynchronous LLM screening of (session_id, content) records with one system prompt. Requests go through the
+        response cache, the per-model rate limiter and an AIMD concurrency window, and are retried `cycle_num` times.
+        :param prompt: system prompt, the content of a record is the user message
+        :param model: model name, the small one in cascade mode
+        :param name: label of the progress lines
+        :param initial_concurrency: starting AIMD window of in-flight requests
+        :param max_concurrency: upper bound of the window
+        :param params: sampling parameters of the requests
+        :param completion_tokens: expected completion length per record, for the rate limiter
+        :param escalate_model: strong model of cascade mode, `Uncertain` or unparsed answers of `model` are screened
+                               again by it and every result records the `Tier` that produced it
+        :param batch_prompt: system prompt of packed requests, records are sent as `<abstract id="n">` blocks and the
+                             answer is a JSON object keyed by n
+        :param pack_size: records per request, above 1 needs `batch_prompt`
+        :param pack_tokens: estimated token budget of the records of one packed request
+        :param prepare: optional function run in a thread on each batch of (session_id, item) pairs, returning one
+                        (content, extra result columns, local response or None) per pair; records with a local
+                        response are not sent to the LLM
+        :param unit: name of the records in reports
+        :param vote_samples: k > 1 screens `Uncertain` or unparsed answers again with k samples (the `n` parameter of
+                             one request, topped up with single requests if fewer choices come back) and keeps the
+                             majority decision, with `Votes` and the `Agreement` ratio; 0 disables voting
+        :param vote_temperature: sampling temperature of the votes
+        :param trace: add `TRACE_COLUMNS` to the LLM responses: model of the decision, seconds and tokens of its
+                      requests (a packed request is shared by its records) and whether it came from the cache
+        """
+        self.prompt = prompt
+        self.model = model
+        self.name = name
+        self.params = params or {}
+        self.cycle_num = cycle_num
+        self.completion_tokens = completion_tokens
+        self.batch_prompt = batch_prompt
+        self.pack_size = pack_size
+        self.pack_tokens = pack_tokens
+        self.prepare = prepare
+        self.unit = unit
+        self.vote_samples = vote_samples
+        self.vote_temperature = vote_temperature
+        self.trace = trace
+        self.controller = AdaptiveConcurrency(initial_concurrency, max_concurrency, name=name)
+        self.escalation = None
+        if escalate_model:
+            self.escalation = (escalate_model, AdaptiveConcurrency(
+                initial_concurrency, max_concurrency, name=f'{name} (escalation)'))
+        self.stats = {'packed_requests': 0, 'packed': 0, 'requeued': 0, 'cascaded': 0, 'escalated': 0,
+                      'voted': 0, 'flipped': 0}
+
+    def messages(self, content, prompt=None):
+        return [
+            {
+                "role": "system",
+                "content": prompt or self.prompt
+            },
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+
+    def traced(self, response, model, trace, share=1):
+        if not self.trace:
+            return response
+        return dict(response, Model=model, Latency=round(trace['latency'], 3), Tokens=trace['tokens'] // share,
+                    Cache_hit=trace['cached'])
+
+    async def fetch(self, session_id, content, model=None, controller=None):
+        model = model or self.model
+        trace = {}
+        response = await chat_completion(
+            self.messages(content), controller or self.controller, model, session_id, self.params,
+            self.cycle_num, self.completion_tokens, trace=trace)
+        return session_id, self.traced(response, model, trace)
+
+    async def fetch_packed(self, batch):
+        """
+        Screen several records in one request, they are numbered 1..n and the answer is a JSON object keyed by number.
+        Records missing from the answer are screened again one by one.
+        :param batch: list of (session_id, content)
+        :return: list of (session_id, response) in the order of `batch`
+        """
+        if len(batch) == 1:
+            return [await self.fetch(*batch[0])]
+        aliases = [str(i + 1) for i in range(len(batch))]
+        content = '\n\n'.join(
+            f'<abstract id="{alias}">\n{text}\n</abstract>' for alias, (_, text) in zip(aliases, batch)
+        )
+
+        def answered(response, alias):
+            return isinstance(response.get(alias), dict) and 'Decision' in response[alias]
+
+        trace = {}
+        response = await chat_completion(
+            self.messages(content, self.batch_prompt), self.controller, self.model, f'pack of {len(batch)}',
+            self.params, self.cycle_num, completion_tokens=self.completion_tokens // 4 * len(batch),
+            validate=lambda r: all(answered(r, alias) for alias in aliases), trace=trace)
+        shared = self.traced({}, self.model, trace, len(batch))
+        responses = [dict(response[alias], **shared) if answered(response, alias) else None for alias in aliases]
+        missing = [i for i, r in enumerate(responses) if r is None]
+        self.stats['packed_requests'] += 1
+        self.stats['packed'] += len(batch)
+        self.stats['requeued'] += len(missing)
+        retried = await asyncio.gather(*[self.fetch(*batch[i]) for i in missing])
+        for i, (_, r) in zip(missing, retried):
+            responses[i] = add_trace(r, shared)
+        return [(session_id, r) for (session_id, _), r in zip(batch, responses)]
+
+    async def vote(self, session_id, content, response):
+        """
+        Screen an undecided record again with `vote_samples` samples and keep the majority decision.
+        :param response: the undecided response, kept if no sample can be parsed
+        """
+        k = self.vote_samples
+        model, controller = self.escalation or (self.model, self.controller)
+        messages = self.messages(content)
+        params = dict(self.params, temperature=self.vote_temperature)
+        trace = {}
+        sampled = await chat_completion(
+            messages, controller, model, session_id, dict(params, n=k), self.cycle_num,
+            completion_tokens=self.completion_tokens * k, samples=True, trace=trace)
+        samples = sampled.get('Samples', [])[:k]
+        if len(samples) < k:
+            # `n` not supported by the endpoint, or the request failed
+            traces = [{} for _ in range(k - len(samples))]
+            extra = await asyncio.gather(*[
+                chat_completion(messages, controller, model, session_id, params, self.cycle_num,
+                                self.completion_tokens, use_cache=False, trace=t) for t in traces])
+            samples += list(extra)
+            trace.update(latency=trace['latency'] + max(t['latency'] for t in traces),
+                         tokens=trace['tokens'] + sum(t['tokens'] for t in traces), cached=False)
+        voted = majority_vote(samples, k)
+        self.stats['voted'] += 1
+        if voted is None:
+            return response
+        if voted['Decision'] != 'Uncertain':
+            self.stats['flipped'] += 1
+        if 'Tier' in response:
+            voted['Tier'] = response['Tier']
+        return add_trace(self.traced(voted, model, trace), response)
+
+    async def screen_batch(self, batch):
+        """
+        Screen a batch of (session_id, content), escalating to the strong model in cascade mode and voting on the
+        answers that are still undecided.
+        :return: list of (session_id, response) in the order of `batch`
+        """
+        results = await self.fetch_packed(batch)
+        if self.escalation is not None:
+            strong_model, strong_controller = self.escalation
+            escalated = [i for i, (_, response) in enumerate(results) if needs_escalation(response)]
+            retried = await asyncio.gather(
+                *[self.fetch(*batch[i], model=strong_model, controller=strong_controller) for i in escalated])
+            results = [(session_id, dict(response, Tier='small')) for session_id, response in results]
+            for i, (session_id, response) in zip(escalated, retried):
+                results[i] = (session_id, add_trace(dict(response, Tier='large'), results[i][1]))
+            self.stats['cascaded'] += len(batch)
+            self.stats['escalated'] += len(escalated)
+        if self.vote_samples > 1:
+            # errors are left to --retry_errors
+            undecided = [i for i, (_, response) in enumerate(results)
+                         if needs_escalation(response) and not is_error(response)]
+            voted = await asyncio.gather(*[self.vote(*batch[i], results[i][1]) for i in undecided])
+            for i, response in zip(undecided, voted):
+                results[i] = (results[i][0], response)
+        return results
+
+    async def _screen_records(self, batch):
+        if self.prepare:
+            prepared = await asyncio.to_thread(self.prepare, batch)
+        else:
+            prepared = [(item, {}, None) for _, item in batch]
+        results = [None] * len(batch)
+        pending = []
+        for i, ((session_id, item), (content, columns, local)) in enumerate(zip(batch, prepared)):
+            if local is None:
+                pending.append((i, (session_id, content)))
+            else:
+                results[i] = (session_id, item, dict(local, **columns))
+        if pending:
+            screened = await self.screen_batch([pair for _, pair in pending])
+            for (i, _), (session_id, response) in zip(pending, screened):
+                results[i] = (session_id, batch[i][1], dict(response, **prepared[i][1]))
+        return results
+
+    async def run(self, records, workers):
+        """
+        Screen records with a fixed pool of workers fed through a bounded queue, so memory depends on `workers` and
+        not on the number of records.
+        :param records: iterable of (session_id, item), consumed lazily
+        :param workers: number of workers, also the queue size
+        :return: async iterator of (session_id, item, response), in completion order
+        """
+        queue = asyncio.Queue(maxsize=workers)
+        finished = asyncio.Queue()
+
+        async def produce():
+            for batch in pack_sessions(records, self.pack_size, self.pack_tokens):
+                await queue.put(batch)
+            for _ in range(workers):
+                await queue.put(None)
+
+        async def work():
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return
+                await finished.put(await self._screen_records(batch))
+
+        tasks = [asyncio.create_task(produce())] + [asyncio.create_task(work()) for _ in range(workers)]
+
+        async def supervise():
+            try:
+                await asyncio.gather(*tasks)
+                await finished.put(None)
+            except Exception as e:
+                await finished.put(e)
+
+        supervisor = asyncio.create_task(supervise())
+        try:
+            while True:
+                results = await finished.get()
+                if results is None:
+                    break
+                if isinstance(results, Exception):
+                    raise results
+                for result in results:
+                    yield result
+        finally:
+            for task in tasks + [supervisor]:
+                task.cancel()
+
+    async def process(self, records, sink, workers):
+        """
+        Screen records and call `sink(session_id, item, response)` as soon as each result is ready.
+        """
+        async for session_id, item, response in self.run(records, workers):
+            sink(session_id, item, response)
+
+    def summary(self):
+        self.controller.summary()
+        if self.escalation:
+            self.escalation[1].summary()
+        if self.stats['packed_requests']:
+            print(f"packing: {self.stats['packed']} {self.unit} in {self.stats['packed_requests']} packed requests, "
+                  f"{self.stats['requeued']} re-queued individually.")
+        if self.stats['cascaded']:
+            print(f"cascade: {self.stats['escalated']} of {self.stats['cascaded']} {self.unit} escalated "
+                  f"to the strong model.")
+        if self.stats['voted']:
+            print(f"voting: {self.stats['voted']} undecided {self.unit} sampled {self.vote_samples} times, "
+                  f"{self.stats['flipped']} decided by majority.")
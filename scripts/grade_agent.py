@@ -16,10 +16,12 @@ async def grade_agent(content, model, lang, cycle=5):
                 {"role": "user", "content": prompts['grade_evaluator'].render(content=content)},
             ]
 
-            respone = await async_respone(messages, model, temperature=0.01, top_p=0.7, max_tokens=12288, cycle=5)
+            respone = await async_respone(
+                messages, model, temperature=0.01, top_p=0.7, max_tokens=12288, cycle=5, refresh=i > 0)
             if respone.get('Run status', '') == "System Error":
                 return respone
             assert 'Final Rating' in respone.keys()
+            return respone
         except Exception as e:
             print(f"[{i}/{cycle}] Worker failed with error: {e}")
             if i == cycle - 1:
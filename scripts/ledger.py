@@ -0,0 +1,82 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from .dedup import text_hash
+
+
+def prompt_version(*parts):
+    """
+    Short digest of the prompts and models of a run, so that editing a prompt or changing a model invalidates the
+    decisions taken with the old one.
+    """
+    return hashlib.sha1('\n'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:12]
+
+
+class ScreeningLedger:
+    def __init__(self, path, version, commit_every=1000):
+        """
+        Persistent record of screening decisions across runs, keyed by (source id, abstract hash, prompt version).
+        A decision is reused only if the same id comes back with the same (normalized) abstract and prompt.
+        :param path: sqlite file, created if missing
+        :param version: prompt version of this run, see `prompt_version`
+        :param commit_every: commit after this many new decisions
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.version = version
+        self.commit_every = commit_every
+        self.reused = 0
+        self.changed = 0
+        self.new = 0
+        self.written = 0
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS decisions ('
+            'session_id TEXT NOT NULL, text_hash TEXT NOT NULL, prompt_version TEXT NOT NULL, '
+            'response TEXT NOT NULL, updated REAL NOT NULL, '
+            'PRIMARY KEY (session_id, text_hash, prompt_version))'
+        )
+
+    def get(self, session_id, text):
+        """
+        :return: the recorded decision of this id, abstract and prompt version, or None (counted as new or changed)
+        """
+        row = self.conn.execute(
+            'SELECT response FROM decisions WHERE session_id = ? AND text_hash = ? AND prompt_version = ?',
+            (str(session_id), text_hash(text), self.version)
+        ).fetchone()
+        if row is not None:
+            self.reused += 1
+            return json.loads(row[0])
+        known = self.conn.execute('SELECT 1 FROM decisions WHERE session_id = ? LIMIT 1', (str(session_id),)).fetchone()
+        if known:
+            self.changed += 1
+        else:
+            self.new += 1
+        return None
+
+    def put(self, session_id, text, response):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO decisions (session_id, text_hash, prompt_version, response, updated) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (str(session_id), text_hash(text), self.version, json.dumps(response, ensure_ascii=False, default=str),
+             time.time())
+        )
+        self.written += 1
+        if self.written % self.commit_every == 0:
+            self.conn.commit()
+
+    def report(self):
+        print(f'ledger: {self.reused} decisions reused, {self.new} new abstracts, {self.changed} with a changed '
+              f'abstract or prompt (prompt version {self.version}).')
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -26,7 +26,7 @@ async def cohort_agent(content, model, lang, max_tokens, cycle=5, rag=None):
     for i in range(cycle):
         try:
             respone = await async_respone(
-                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5)
+                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5, refresh=i > 0)
             if respone.get('Run status', '') == "System Error":
                 return respone
             for k, v in respone.items():
@@ -63,7 +63,7 @@ async def outcome_agent(content, model, lang, max_tokens, cycle=5, rag=None):
     for i in range(cycle):
         try:
             respone = await async_respone(
-                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5)
+                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5, refresh=i > 0)
             if respone.get('Run status', '') == "System Error":
                 return respone
             assert 'Design' in respone.keys()
@@ -94,7 +94,7 @@ async def l1_cancer_agent(content, model, lang, max_tokens, cycle=5, rag=None):
     for i in range(cycle):
         try:
             respone = await async_respone(
-                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5)
+                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5, refresh=i > 0)
             if respone.get('Run status', '') == "System Error":
                 return respone
             for k, v in respone.items():
@@ -125,7 +125,7 @@ async def l1_risk_factor_agent(content, model, lang, max_tokens, cycle=5, rag=No
     for i in range(cycle):
         try:
             respone = await async_respone(
-                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5)
+                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5, refresh=i > 0)
             if respone.get('Run status', '') == "System Error":
                 return respone
             assert 'Risk_factors' in respone.keys()
@@ -154,7 +154,7 @@ async def l1_risk_factor_check_agent(content, risk_factors, model, lang, max_tok
     for i in range(cycle):
         try:
             respone = await async_respone(
-                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5)
+                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5, refresh=i > 0)
             if respone.get('Run status', '') == "System Error":
                 return respone
             assert 'Direct_Exposure' in respone.keys()
@@ -185,7 +185,7 @@ async def l1_effect_size_agent(content, model, lang, max_tokens, cycle=5, rag=No
     for i in range(cycle):
         try:
             respone = await async_respone(
-                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5)
+                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5, refresh=i > 0)
             if respone.get('Run status', '') == "System Error":
                 return respone
             assert 'Design' in respone.keys()
@@ -219,7 +219,7 @@ async def cancer_agent(content, abs_path, model, lang, max_tokens, cycle=5):
     for i in range(cycle):
         try:
             respone = await async_respone(
-                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5)
+                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5, refresh=i > 0)
             if respone.get('Run status', '') == "System Error":
                 return respone
             for k, v in respone.items():
@@ -252,7 +252,7 @@ async def risk_factor_agent(content, abs_path, model, lang, max_tokens, cycle=5)
     for i in range(cycle):
         try:
             respone = await async_respone(
-                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5)
+                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5, refresh=i > 0)
             if respone.get('Run status', '') == "System Error":
                 return respone
             for k, v in respone.items():
@@ -299,7 +299,7 @@ async def group_agent(
     for i in range(cycle):
         try:
             respone = await async_respone(
-                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5)
+                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5, refresh=i > 0)
             if respone.get('Run status', '') == "System Error":
                 return respone
             for k, v in respone.items():
@@ -349,7 +349,7 @@ async def group_check_agent(
     for i in range(cycle):
         try:
             respone = await async_respone(
-                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5)
+                messages, model, temperature=0.01, top_p=0.7, max_tokens=max_tokens, cycle=5, refresh=i > 0)
             if respone.get('Run status', '') == "System Error":
                 return respone
             for k, v in respone.items():
@@ -1,43 +1,105 @@
 # Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
 # SPDX-License-Identifier: MIT
-import asyncio
+import httpx
 from typing import Dict
 from .base import json_parse
+from .cache import ResponseCache, get_cache, close_cache
+from .rate_limit import get_limiter, estimate_tokens, is_rate_limited, retry_after, usage_tokens
 from volcenginesdkarkruntime import AsyncArk
-from .llm_info import model_agent as chat_api_key
-from .llm_info import model_vison as vision_api_key
+from .llm_info import api_key, chat_base_url
+from .llm_info import http_max_connections, http_max_keepalive, http_keepalive_expiry
+from .llm_info import http_timeout, http_connect_timeout
 
+_clients = {}
 
-async def async_respone(messages, model, temperature=0.01, top_p=0.7, max_tokens=12288, cycle=5) -> Dict:
+
+def get_client(model, base_url=chat_base_url, key=api_key, max_connections=None, max_keepalive=None,
+               timeout=None, connect_timeout=None) -> AsyncArk:
+    """
+    Return the process-wide AsyncArk client for (model, base_url), creating it on first use.
+    The client keeps a keep-alive connection pool, so repeated calls reuse open TLS connections.
+    :param model: model name the client is used for
+    :param base_url: Ark endpoint
+    :param key: Ark api key
+    :param max_connections: pool size, defaults to `http_max_connections` in llm_info
+    :param max_keepalive: idle connections kept open, defaults to `http_max_keepalive` in llm_info
+    :param timeout: read/write timeout in seconds, defaults to `http_timeout` in llm_info
+    :param connect_timeout: connect timeout in seconds, defaults to `http_connect_timeout` in llm_info
+    :return: shared AsyncArk client
+    """
+    client_key = (model, base_url)
+    client = _clients.get(client_key)
+    if client is not None:
+        return client
+    limits = httpx.Limits(
+        max_connections=max_connections or http_max_connections,
+        max_keepalive_connections=max_keepalive or http_max_keepalive,
+        keepalive_expiry=http_keepalive_expiry,
+    )
+    client_timeout = httpx.Timeout(timeout or http_timeout, connect=connect_timeout or http_connect_timeout)
     client = AsyncArk(
-        api_key=chat_api_key
+        api_key=key,
+        base_url=base_url,
+        timeout=client_timeout,
+        http_client=httpx.AsyncClient(limits=limits, timeout=client_timeout),
     )
-    semaphore = asyncio.Semaphore(3)
-    async with semaphore:
-        for attempt in range(cycle):
-            try:
-                response = await client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=temperature,
-                    top_p=top_p,
-                    max_tokens=max_tokens,
-                )
-                response_content = ' '.join(response.choices[0].message.content.replace('，', ',').split())
-                if '</answer>' in response_content:
-                    response_content = response_content.split('<answer>')[-1].strip('</answer>')
-                if "I'm unable to answer that question" in response_content:
-                    return {"Run status": "System Error"}
-                response = json_parse(response_content)
-                return response
-            except Exception as e:
-                if attempt == cycle - 1:
-                    return {
-                        "Run status": "System Error",
-                        "content": f"Failed to generate final answer after 5 attempts. Error: {str(e)}"
-                    }
-                if "Error code: 429" in str(e):
-                    await asyncio.sleep(60)
+    _clients[client_key] = client
+    return client
+
+
+async def close_clients():
+    """
+    Close every pooled client and the response cache. Call once before the event loop shuts down.
+    """
+    close_cache()
+    while _clients:
+        _, client = _clients.popitem()
+        try:
+            await client.close()
+        except Exception as e:
+            print(f'Failed to close client: {e}')
+
+
+async def async_respone(
+        messages, model, temperature=0.01, top_p=0.7, max_tokens=12288, cycle=5, refresh=False) -> Dict:
+    # refresh: ignore a cached response that failed validation upstream and overwrite it
+    cache = get_cache()
+    cache_key = ResponseCache.make_key(model, messages, temperature=temperature, top_p=top_p, max_tokens=max_tokens)
+    if cache and not refresh:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    client = get_client(model)
+    limiter = get_limiter(model)
+    estimated = estimate_tokens(messages, min(max_tokens, 1024))
+    for attempt in range(cycle):
+        try:
+            await limiter.acquire(estimated)
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                top_p=top_p,
+                max_tokens=max_tokens,
+            )
+            limiter.record(usage_tokens(response), estimated)
+            response_content = ' '.join(response.choices[0].message.content.replace('，', ',').split())
+            if '</answer>' in response_content:
+                response_content = response_content.split('<answer>')[-1].strip('</answer>')
+            if "I'm unable to answer that question" in response_content:
+                return {"Run status": "System Error"}
+            response = json_parse(response_content)
+            if cache and response:
+                cache.set(cache_key, response)
+            return response
+        except Exception as e:
+            if attempt == cycle - 1:
+                return {
+                    "Run status": "System Error",
+                    "content": f"Failed to generate final answer after 5 attempts. Error: {str(e)}"
+                }
+            if is_rate_limited(e):
+                limiter.pause(retry_after(e))
 
 
 async def async_chat_with_image(prompt, base64_image, vision_model, cycle=5):
@@ -45,39 +107,49 @@ async def async_chat_with_image(prompt, base64_image, vision_model, cycle=5):
     # image_path = "path_to_your_image.jpg"
     # 将图片转为Base64编码
     # base64_image = encode_image(image_path)
-    client = AsyncArk(
-        api_key=vision_api_key
-    )
-    semaphore = asyncio.Semaphore(3)
-    async with semaphore:
-        for attempt in range(cycle):
-            try:
-                response = await client.chat.completions.create(
-                    model=vision_model,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": prompt,
-                                },
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{base64_image}"
-                                    },
-                                },
-                            ],
-                        }
-                    ],
-                )
-                msg = response.choices[0].message.content.replace('$', '').replace('\\', '')
-                if "I'm unable to answer that question" in msg:
-                    return 'System Error'
-                return msg
-            except Exception as e:
-                if attempt == cycle - 1:
-                    return f'Failed to generate step after {cycle} attempts. Error: {str(e)}"'
-                if "Error code: 429" in str(e):
-                    await asyncio.sleep(60)
+    client = get_client(vision_model)
+    limiter = get_limiter(vision_model)
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": prompt,
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{base64_image}"
+                    },
+                },
+            ],
+        }
+    ]
+    cache = get_cache()
+    cache_key = ResponseCache.make_key(vision_model, messages)
+    if cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    # image tokens are not counted by estimate_tokens, reserve them with the completion
+    estimated = estimate_tokens(messages, 2048)
+    for attempt in range(cycle):
+        try:
+            await limiter.acquire(estimated)
+            response = await client.chat.completions.create(
+                model=vision_model,
+                messages=messages,
+            )
+            limiter.record(usage_tokens(response), estimated)
+            msg = response.choices[0].message.content.replace('$', '').replace('\\', '')
+            if "I'm unable to answer that question" in msg:
+                return 'System Error'
+            if cache:
+                cache.set(cache_key, msg)
+            return msg
+        except Exception as e:
+            if attempt == cycle - 1:
+                return f'Failed to generate step after {cycle} attempts. Error: {str(e)}"'
+            if is_rate_limited(e):
+                limiter.pause(retry_after(e))
@@ -1,13 +1,19 @@
 # Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
 # SPDX-License-Identifier: MIT
+import os
+
 api_key = '<set your ark llm api key>'
 chat_base_url = "https://ark.cn-beijing.volces.com/api/v3"
 
 # model for abstract filter (Text model is enough)
 model_abstract_filter = '<set your model name for abstract filter>'
+# small, fast model screening first in cascade mode (--cascade)
+model_abstract_filter_small = '<set your small model name for abstract filter>'
 
 # model for abstract filter (Text model is enough)
 model_full_text_filter = '<set your model name for full text filter>'
+# small, fast model screening first in cascade mode (--cascade)
+model_full_text_filter_small = '<set your small model name for full text filter>'
 
 # model for image understanding (vison model)
 model_vison = '<set your model name for image understanding>'
@@ -18,3 +24,26 @@ model_embed = '<set your model name for embedding>'
 
 # model for agent (Text model is enough)
 model_agent = '<set your model name for agent>'
+
+# http connection pool shared by all clients of the same model and base url
+http_max_connections = 100
+http_max_keepalive = 20
+http_keepalive_expiry = 60
+http_timeout = 3600
+http_connect_timeout = 10
+
+# rate limit shared by every stage of one process, {model name: (requests per minute, tokens per minute)}
+rate_limits = {}
+default_rpm = 1000
+default_tpm = 1000000
+# fraction of the quota actually used, so that all stages together stay just under it
+rate_limit_headroom = 0.9
+# seconds all callers of a model wait after a 429 without Retry-After
+rate_limit_pause = 60
+
+# on-disk cache of parsed LLM responses, keyed by model + messages + sampling parameters
+cache_path = os.path.expanduser('~/.cache/canrisk_ai/llm_cache.sqlite')
+cache_max_size_mb = 2048
+cache_max_age_days = 90
+# set True to neither read nor write the cache
+cache_bypass = False
@@ -0,0 +1,133 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import csv
+import math
+from .checkpoint import PeriodicSync
+
+OUTPUT_FORMATS = ('tsv', 'parquet')
+# rows buffered before a Parquet row group is written
+ROW_GROUP_SIZE = 10000
+CATEGORY_COLUMNS = ('Decision', 'Reason_id', 'Reason', 'Prefilter', 'Tier', 'Model', 'Stat_check')
+INT_COLUMNS = ('Tokens', 'Tokens_full', 'Tokens_sent', 'Stat_hits')
+FLOAT_COLUMNS = ('Gate', 'Agreement', 'Latency')
+BOOL_COLUMNS = ('Cache_hit',)
+
+
+def column_type(column):
+    """
+    :return: arrow type of a result column, dictionary-encoded strings for the low-cardinality ones and strings for
+             the columns not listed above
+    """
+    import pyarrow as pa
+    if column in CATEGORY_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    if column in INT_COLUMNS:
+        return pa.int32()
+    if column in FLOAT_COLUMNS:
+        return pa.float32()
+    if column in BOOL_COLUMNS:
+        return pa.bool_()
+    return pa.string()
+
+
+def _convert(value, column):
+    if value is None or value == '' or isinstance(value, float) and math.isnan(value):
+        return None
+    try:
+        if column in INT_COLUMNS:
+            return int(float(value))
+        if column in FLOAT_COLUMNS:
+            return float(value)
+    except ValueError:
+        return None
+    if column in BOOL_COLUMNS:
+        return str(value).lower() in ('true', '1')
+    return str(value)
+
+
+class TsvSink:
+    def __init__(self, path, columns):
+        """
+        Append rows to a headerless tsv, flushed after each row.
+        """
+        self.columns = columns
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file, delimiter='\t', lineterminator='\n')
+        self.sync = PeriodicSync(self.file)
+
+    def write(self, row):
+        self.writer.writerow([row.get(column, '') for column in self.columns])
+        self.sync.tick()
+
+    def close(self):
+        self.sync.sync()
+        self.file.close()
+
+
+class ParquetSink:
+    def __init__(self, path, columns, row_group_size=ROW_GROUP_SIZE):
+        """
+        Write rows to a Parquet file with typed columns (see `column_type`), one row group per `row_group_size`
+        rows, so the whole table is never held in memory. Needs pyarrow.
+        :param columns: column names, values missing from a row are null
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([(column, column_type(column)) for column in columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append({column: _convert(row.get(column), column) for column in self.columns})
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+        if self.rows:
+            self.writer.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def open_sink(path, columns, output_format='tsv'):
+    if output_format == 'parquet':
+        return ParquetSink(path, columns)
+    return TsvSink(path, columns)
+
+
+def result_columns(responses, columns=()):
+    """
+    :return: `columns` followed by the other keys of `responses`, in order of first appearance
+    """
+    columns = list(columns)
+    seen = set(columns)
+    for response in responses:
+        for key in response:
+            if key not in seen:
+                seen.add(key)
+                columns.append(key)
+    return columns
+
+
+def write_parquet(df, completed, path, columns=()):
+    """
+    Write the input rows that have a result to a Parquet file, in input order, followed by the result columns.
+    :param df: input table, its first column is the session id
+    :param completed: dict of str(session_id) -> response
+    :param columns: result columns placed first, the other keys of the responses follow
+    """
+    input_columns = [str(column) for column in df.columns]
+    sink = ParquetSink(path, result_columns(completed.values(), input_columns + list(columns)))
+    try:
+        for row in df.itertuples(index=False):
+            response = completed.get(str(row[0]))
+            if response is not None:
+                sink.write(dict(response, **dict(zip(input_columns, row))))
+    finally:
+        sink.close()
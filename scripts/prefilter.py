@@ -0,0 +1,78 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import os
+import re
+import csv
+from collections import Counter
+
+default_rules_file = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'lib',
+                                  'prefilter_rules.tsv')
+
+
+class PreFilter:
+    def __init__(self, rules_file=default_rules_file, audit=False):
+        """
+        Deterministic pre-screen of abstracts ahead of the LLM. Each rule of `rules_file` (tsv with columns rule,
+        reason_id, lang, pattern, unless) rejects an abstract matching `pattern` unless it also matches `unless`.
+        Rows with the same rule name are OR-ed, the first matching rule (in file order) wins.
+        :param rules_file: rule table, defaults to lib/prefilter_rules.tsv
+        :param audit: do not reject anything, only tag LLM results with the rule that would have fired
+        """
+        self.audit_mode = audit
+        self.rules = []
+        with open(rules_file, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+                pattern = re.compile(row['pattern'], re.IGNORECASE | re.MULTILINE)
+                unless = re.compile(row['unless'], re.IGNORECASE) if row.get('unless') else None
+                self.rules.append((row['rule'], row['reason_id'], pattern, unless))
+        self.hits = Counter()
+        self.llm_rejected = Counter()
+        self.checked = 0
+
+    def match(self, text):
+        """
+        :return: (rule name, reason id) of the first rule firing on `text`, or None
+        """
+        text = str(text)
+        for name, reason_id, pattern, unless in self.rules:
+            if pattern.search(text) and not (unless and unless.search(text)):
+                return name, reason_id
+        return None
+
+    def screen(self, text):
+        """
+        :return: a `Rejected` response if a rule fires (never in audit mode), else None
+        """
+        self.checked += 1
+        if self.audit_mode:
+            return None
+        matched = self.match(text)
+        if matched is None:
+            return None
+        self.hits[matched[0]] += 1
+        return {'Decision': 'Rejected', 'Reason_id': matched[1], 'Prefilter': matched[0]}
+
+    def audit(self, text, response):
+        """
+        In audit mode, tag an LLM response with the rule that would have rejected it and count the agreement.
+        """
+        if not self.audit_mode:
+            return response
+        matched = self.match(text)
+        if matched is None:
+            return response
+        self.hits[matched[0]] += 1
+        if response.get('Decision') == 'Rejected':
+            self.llm_rejected[matched[0]] += 1
+        return dict(response, Prefilter=matched[0])
+
+    def report(self):
+        total = sum(self.hits.values())
+        verb = 'would reject' if self.audit_mode else 'rejected'
+        print(f'prefilter: {verb} {total} of {self.checked} abstracts.')
+        for name, count in self.hits.most_common():
+            if self.audit_mode:
+                agree = self.llm_rejected[name]
+                print(f'  {name}: {count} hits, LLM rejected {agree} ({agree / count:.1%})')
+            else:
+                print(f'  {name}: {count} hits')
@@ -38,6 +38,18 @@ prompt_abstract_filter = '''# 角色
     ```
 '''
 
+# the same rules, for several abstracts per request (1.Abstract_filter.py --pack)
+prompt_abstract_filter_batch = prompt_abstract_filter.split('# 输出：')[0] + '''# 输出：
+    1. 用户会一次提供多篇摘要，每篇摘要以 <abstract id="编号"> 和 </abstract> 包裹，请逐篇独立判断，互不影响。
+    2. 严格以 JSON 格式输出，key 为摘要编号，每个编号都必须出现且只出现一次，下方为示例：
+    ```json
+    {
+      "1": {"Decision": "Accepted/Rejected/Uncertain", "Reason_id": "排除项中的 1-6 或者 other，当出现多种原因时，请回复主要原因。"},
+      "2": {"Decision": "Accepted/Rejected/Uncertain", "Reason_id": "排除项中的 1-6 或者 other"}
+    }
+    ```
+'''
+
 prompt_full_text_filter = '''# 角色
 你是一位专业Meta分析论文审查员。
 
@@ -820,6 +820,7 @@ prompts = {
     'table_prompts': table_prompts,
     'figure_prompts': figure_prompts,
     'common_input': common_input,
+    'sys_prompt_cohort_evaluator': sys_prompt_cohort_evaluator,
     'sys_prompt_cancers': sys_prompt_cancers,
     'sys_prompt_outcomes': sys_prompt_outcomes,
     'sys_prompt_risk_factor': sys_prompt_risk_factor,
@@ -0,0 +1,159 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import re
+import time
+import asyncio
+from .llm_info import rate_limits, default_rpm, default_tpm, rate_limit_headroom, rate_limit_pause
+
+_limiters = {}
+# fraction of the quota used by this process, see `set_share`
+_share = 1.0
+_cjk_pattern = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+class RateLimiter:
+    def __init__(self, rpm, tpm):
+        """
+        Token bucket limiter that tracks requests per minute and tokens per minute for one model.
+        All coroutines of the process share one instance per model (see `get_limiter`).
+        :param rpm: requests allowed per minute
+        :param tpm: tokens (prompt + completion) allowed per minute
+        """
+        self.base_rpm = rpm
+        self.base_tpm = tpm
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        # nothing is refilled before the end of a pause, see `pause`
+        elapsed = max(now - self._updated, 0)
+        self._updated = max(now, self._updated)
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens=0):
+        """
+        Wait until one request and `tokens` estimated tokens are available, then take them.
+        Waiters are served in arrival order.
+        :param tokens: estimated tokens of the request
+        """
+        tokens = min(tokens, self.tpm)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self._requests) * 60 / self.rpm,
+                    (tokens - self._tokens) * 60 / self.tpm,
+                )
+                await asyncio.sleep(max(wait, 0.01))
+
+    def record(self, used_tokens, estimated_tokens):
+        """
+        Correct the token bucket once the real usage of a request is known.
+        :param used_tokens: total tokens reported by the API
+        :param estimated_tokens: tokens taken by `acquire` for the same request
+        """
+        if used_tokens:
+            self._tokens -= used_tokens - estimated_tokens
+
+    def pause(self, seconds=None):
+        """
+        Block every caller of this limiter for `seconds` (after a 429 or Retry-After).
+        :param seconds: pause length, defaults to `rate_limit_pause` in llm_info
+        """
+        seconds = rate_limit_pause if seconds is None else seconds
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._requests = 0.0
+        # refill from the end of the pause, so the waiters are not all released at once when it ends
+        self._updated = max(self._updated, self._paused_until)
+
+    def scale(self, share):
+        """
+        Use `share` of the configured limits, e.g. when several processes split one quota.
+        """
+        self._refill()
+        self.rpm = self.base_rpm * share
+        self.tpm = self.base_tpm * share
+        self._requests = min(self._requests, self.rpm)
+        self._tokens = min(self._tokens, self.tpm)
+
+
+def get_limiter(model) -> RateLimiter:
+    """
+    Return the process-wide limiter for `model`. Limits come from `rate_limits` in llm_info, falling back to
+    `default_rpm`/`default_tpm`, and are scaled by `rate_limit_headroom` to stay just under the quota.
+    """
+    limiter = _limiters.get(model)
+    if limiter is None:
+        rpm, tpm = rate_limits.get(model, (default_rpm, default_tpm))
+        limiter = RateLimiter(rpm * rate_limit_headroom, tpm * rate_limit_headroom)
+        limiter.scale(_share)
+        _limiters[model] = limiter
+    return limiter
+
+
+def set_share(share):
+    """
+    Scale every limiter of the process, current and future, to `share` of its quota.
+    """
+    global _share
+    _share = share
+    for limiter in _limiters.values():
+        limiter.scale(share)
+
+
+def estimate_tokens(messages, completion_tokens=0):
+    """
+    Rough token estimate of a chat request: one token per CJK character, one per four other characters.
+    :param messages: chat messages, `content` may be a string or a list of parts
+    :param completion_tokens: expected completion length added to the estimate
+    """
+    total = completion_tokens
+    for message in messages:
+        content = message.get('content', '')
+        if isinstance(content, list):
+            content = ' '.join(part.get('text', '') for part in content if part.get('type') == 'text')
+        total += text_tokens(content) + 4
+    return total
+
+
+def text_tokens(text):
+    cjk = len(_cjk_pattern.findall(text))
+    return cjk + (len(text) - cjk) // 4
+
+
+def is_rate_limited(e):
+    return getattr(e, 'status_code', None) == 429 or 'Error code: 429' in str(e)
+
+
+def retry_after(e):
+    """
+    Seconds requested by the Retry-After header of a failed request, or None.
+    """
+    response = getattr(e, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def usage_tokens(completion):
+    usage = getattr(completion, 'usage', None)
+    return getattr(usage, 'total_tokens', 0) or 0
@@ -0,0 +1,135 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import io
+import os
+import re
+import gzip
+import pandas as pd
+import xml.etree.ElementTree as ET
+
+INPUT_FORMATS = ('auto', 'tsv', 'pubmed', 'ris')
+_ris_line = re.compile(r'^([A-Z][A-Z0-9])  -(?: (.*))?$')
+
+
+def open_binary(path):
+    """
+    Open a plain, gzip (.gz) or zstandard (.zst) file for reading bytes. zstandard is only needed for .zst files.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+
+def open_text(path, encoding='utf-8-sig'):
+    return io.TextIOWrapper(open_binary(path), encoding=encoding, errors='replace')
+
+
+def detect_format(path):
+    name = path.lower()
+    for suffix in ('.gz', '.zst'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    _, ext = os.path.splitext(name)
+    if ext == '.xml':
+        return 'pubmed'
+    if ext == '.ris':
+        return 'ris'
+    return 'tsv'
+
+
+def join_title(title, abstract):
+    # one line per record, so the text stays a single tsv field
+    return ' '.join(f'{title} {abstract}'.split())
+
+
+def read_tsv(path, chunk_size=10000):
+    """
+    (id, abstract) pairs of a headerless tsv, plain or compressed (compression inferred from the extension).
+    """
+    for chunk in pd.read_table(path, header=None, chunksize=chunk_size):
+        yield from zip(chunk[0], chunk[1])
+
+
+def read_pubmed_xml(path):
+    """
+    (PMID, title + abstract) pairs of a PubMed XML file (e.g. a baseline or update file, optionally .gz),
+    parsed incrementally. Structured abstracts keep their section labels, articles without abstract are skipped.
+    """
+    skipped = 0
+    with open_binary(path) as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event != 'end' or elem.tag != 'PubmedArticle':
+                continue
+            citation = elem.find('MedlineCitation')
+            pmid = citation.findtext('PMID') if citation is not None else None
+            sections = []
+            for text in elem.iterfind('MedlineCitation/Article/Abstract/AbstractText'):
+                content = ''.join(text.itertext()).strip()
+                label = text.get('Label')
+                if content:
+                    sections.append(f'{label}: {content}' if label else content)
+            if pmid and sections:
+                title = elem.find('MedlineCitation/Article/ArticleTitle')
+                title = ''.join(title.itertext()).strip() if title is not None else ''
+                yield pmid.strip(), join_title(title, ' '.join(sections))
+            else:
+                skipped += 1
+            # drop parsed articles, the tree would otherwise grow with the whole file
+            root.clear()
+    if skipped:
+        print(f'{path}: {skipped} articles without PMID or abstract skipped.')
+
+
+def read_ris(path, id_tags=('AN', 'ID', 'DO')):
+    """
+    (id, title + abstract) pairs of a RIS export (Embase, Cochrane...), read line by line.
+    :param id_tags: tags tried in order for the citation id, records without any of them get `<file name>:<number>`
+    """
+    skipped = 0
+    number = 0
+    record, tag = {}, None
+    with open_text(path) as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            matched = _ris_line.match(line)
+            if matched is None:
+                # continuation of a wrapped value
+                if tag and line.strip():
+                    record[tag][-1] += ' ' + line.strip()
+                continue
+            tag, value = matched.group(1), (matched.group(2) or '').strip()
+            if tag == 'ER':
+                number += 1
+                abstract = ' '.join(record.get('AB', []) or record.get('N2', []))
+                if abstract:
+                    session_id = next((record[t][0] for t in id_tags if record.get(t)), None) \
+                        or f'{os.path.basename(path)}:{number}'
+                    title = (record.get('TI') or record.get('T1') or [''])[0]
+                    yield session_id, join_title(title, abstract)
+                else:
+                    skipped += 1
+                record, tag = {}, None
+                continue
+            record.setdefault(tag, []).append(value)
+    if skipped:
+        print(f'{path}: {skipped} records without abstract skipped.')
+
+
+def read_records(path, input_format='auto', chunk_size=10000):
+    """
+    Stream (id, abstract) pairs of an abstract screening input with constant memory.
+    :param input_format: one of `INPUT_FORMATS`, `auto` guesses it from the extension (.xml, .ris, else tsv)
+    :param chunk_size: rows per chunk of tsv inputs
+    """
+    if input_format == 'auto':
+        input_format = detect_format(path)
+    if input_format == 'pubmed':
+        return read_pubmed_xml(path)
+    if input_format == 'ris':
+        return read_ris(path)
+    return read_tsv(path, chunk_size)
@@ -0,0 +1,104 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import re
+from .rate_limit import text_tokens
+
+_heading = re.compile(r'^#{1,6}\s+(.*)$')
+_numbering = re.compile(r'^(\d+(\.\d+)*\.?|[IVX]+\.)\s*')
+_table = re.compile(r'<table|^\|.*\|\s*$|^(table|表)\s*\d', re.IGNORECASE | re.MULTILINE)
+# first match wins, headings that match nothing belong to the section above them
+SECTION_PATTERNS = [
+    ('references', re.compile(r'references?\b|bibliography|literature cited|参考文献', re.IGNORECASE)),
+    ('back_matter', re.compile(
+        r'acknowledge?ments?|funding|financial (support|disclosure)|conflicts? of interest|competing interests?|'
+        r'declaration of|disclosures?\b|author(s\'?)? contributions?|data (availability|sharing)|ethics|'
+        r'abbreviations|致谢|基金|利益冲突|作者贡献', re.IGNORECASE)),
+    ('supplementary', re.compile(r'supplement|appendix|附录', re.IGNORECASE)),
+    ('abstract', re.compile(r'abstract|summary|摘要', re.IGNORECASE)),
+    ('introduction', re.compile(r'introduction|background|引言|前言|背景', re.IGNORECASE)),
+    ('methods', re.compile(
+        r'(materials? and )?methods?|methodology|study (design|population|participants)|participants|subjects|'
+        r'patients( and| population)|statistical analys|方法|对象', re.IGNORECASE)),
+    ('results', re.compile(r'results?\b|findings|结果', re.IGNORECASE)),
+    ('discussion', re.compile(r'discussion|讨论', re.IGNORECASE)),
+    ('conclusion', re.compile(r'conclusions?|结论', re.IGNORECASE)),
+]
+# lower is kept first; sections not listed here are always dropped
+SECTION_PRIORITIES = {
+    'front': 0, 'abstract': 0, 'methods': 1, 'results': 1, 'table': 1, 'conclusion': 2, 'discussion': 3,
+    'introduction': 4, 'supplementary': 5,
+}
+
+
+def is_table(block):
+    return bool(_table.search(block))
+
+
+def section_category(heading):
+    """
+    :return: category of a heading (see `SECTION_PATTERNS`), or None if it does not look like a section title
+    """
+    heading = _numbering.sub('', heading.strip().strip('*').strip())
+    for category, pattern in SECTION_PATTERNS:
+        if pattern.match(heading):
+            return category
+    return None
+
+
+def split_blocks(text):
+    """
+    Split a MinerU markdown file into paragraphs labelled with their section.
+    Text before the first recognized heading (title, authors, often the abstract) is `front`.
+    :return: list of (section number, category, is heading, block)
+    """
+    blocks = []
+    category, section = 'front', 0
+    for block in text.split('\n\n'):
+        block = block.strip()
+        if not block:
+            continue
+        heading = _heading.match(block)
+        if heading and '\n' not in block:
+            section += 1
+            category = section_category(heading.group(1)) or category
+            blocks.append((section, category, True, block))
+            continue
+        blocks.append((section, category, False, block))
+    return blocks
+
+
+def budget_text(text, max_tokens):
+    """
+    Keep the most useful paragraphs of a paper within `max_tokens` estimated tokens: front matter and abstract, then
+    methods, results and tables, conclusion, discussion, introduction. References and back matter are always dropped.
+    Kept paragraphs stay in document order, under the heading of their section.
+    :return: (kept text, estimated tokens of `text`, estimated tokens of the kept text)
+    """
+    before = text_tokens(text)
+    blocks = split_blocks(text)
+    headings = {section: i for i, (section, _, is_heading, _) in enumerate(blocks) if is_heading}
+    candidates = []
+    for i, (section, category, is_heading, block) in enumerate(blocks):
+        if is_heading or category not in SECTION_PRIORITIES:
+            continue
+        priority = SECTION_PRIORITIES[category]
+        if is_table(block):
+            priority = min(priority, SECTION_PRIORITIES['table'])
+        candidates.append((priority, i))
+    kept, used = set(), 0
+    for _, i in sorted(candidates):
+        cost = text_tokens(blocks[i][3])
+        heading = headings.get(blocks[i][0])
+        if heading is not None and heading not in kept:
+            cost += text_tokens(blocks[heading][3])
+        if used + cost <= max_tokens:
+            kept.add(i)
+            if heading is not None:
+                kept.add(heading)
+            used += cost
+    if not kept:
+        # no paragraph fits (e.g. a file without blank lines), keep the beginning
+        kept_text = text[:int(len(text) * max_tokens / max(before, 1))]
+        return kept_text, before, text_tokens(kept_text)
+    kept_text = '\n\n'.join(blocks[i][3] for i in sorted(kept))
+    return kept_text, before, text_tokens(kept_text)
@@ -0,0 +1,163 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+"""
+Split a screening run over several machines with `--shard i/N`, then merge the shard outputs:
+
+    python -m scripts.shard merge -o output.tsv --input input.tsv output_0.tsv output_1.tsv output_2.tsv
+"""
+import os
+import csv
+import sys
+import time
+import socket
+import asyncio
+import hashlib
+from collections import Counter
+from .rate_limit import set_share
+from .readers import read_records, INPUT_FORMATS
+
+
+def parse_shard(value):
+    """
+    :param value: `i/N` with 0 <= i < N
+    :return: (i, N)
+    :raise argparse.ArgumentTypeError: so argparse reports the message
+    """
+    from argparse import ArgumentTypeError
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ArgumentTypeError(f'shard must look like i/N, got {value!r}')
+    if not 0 <= index < count:
+        raise ArgumentTypeError(f'shard index must be in [0, {count}), got {index}')
+    return index, count
+
+
+def shard_of(session_id, count):
+    # stable across processes and machines, unlike hash()
+    digest = hashlib.sha1(str(session_id).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+
+def in_shard(session_id, shard):
+    return shard is None or shard_of(session_id, shard[1]) == shard[0]
+
+
+class ShardLease:
+    def __init__(self, lease_dir, shard, interval=30, ttl=None):
+        """
+        Split the rate limit of the account among the shards currently running. Each shard refreshes its own lease
+        file in `lease_dir` (on a filesystem shared by the machines) every `interval` seconds, and uses 1 / (number of
+        fresh lease files) of every limit.
+        :param lease_dir: shared directory, created if missing
+        :param shard: (i, N) of this process
+        :param interval: seconds between refreshes
+        :param ttl: a lease older than this is considered dead, defaults to 3 x interval
+        """
+        os.makedirs(lease_dir, exist_ok=True)
+        self.lease_dir = lease_dir
+        self.path = os.path.join(lease_dir, f'shard-{shard[0]}-of-{shard[1]}.lease')
+        self.interval = interval
+        self.ttl = ttl or 3 * interval
+        self.active_shards = 0
+        self._task = None
+
+    def refresh(self):
+        with open(self.path, 'w') as f:
+            f.write(f'{socket.gethostname()} {os.getpid()} {time.time()}\n')
+        now = time.time()
+        active = 0
+        for name in os.listdir(self.lease_dir):
+            if not name.endswith('.lease'):
+                continue
+            try:
+                if now - os.path.getmtime(os.path.join(self.lease_dir, name)) <= self.ttl:
+                    active += 1
+            except OSError:
+                # removed by a shard that just finished
+                continue
+        active = max(active, 1)
+        if active != self.active_shards:
+            self.active_shards = active
+            set_share(1 / active)
+            print(f'lease: {active} active shards, using 1/{active} of the rate limit.')
+
+    async def _run(self):
+        while True:
+            self.refresh()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.refresh()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def merge(output_files, merged_file, input_file=None, input_format='auto'):
+    """
+    Concatenate headerless shard outputs, keeping the first row of an id seen in several outputs.
+    :param input_file: original input, used to check that every id has a row
+    :return: True if the merged output covers the input without duplicates
+    """
+    seen = set()
+    duplicates = []
+    widths = Counter()
+    with open(merged_file, 'w', newline='', encoding='utf-8') as out:
+        writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+        for file_name in output_files:
+            with open(file_name, newline='', encoding='utf-8') as f:
+                for row in csv.reader(f, delimiter='\t'):
+                    if not row:
+                        continue
+                    if row[0] in seen:
+                        duplicates.append(row[0])
+                        continue
+                    seen.add(row[0])
+                    widths[len(row)] += 1
+                    writer.writerow(row)
+    print(f'merge: {len(seen)} ids from {len(output_files)} files, {len(duplicates)} duplicate rows dropped.')
+    if duplicates:
+        print(f'  duplicate ids: {", ".join(duplicates[:10])}{" ..." if len(duplicates) > 10 else ""}')
+    if len(widths) > 1:
+        print(f'  rows have different column counts {sorted(widths)}, stream mode outputs have a fixed layout.')
+    ok = not duplicates
+    if input_file:
+        expected = {str(session_id) for session_id, _ in read_records(input_file, input_format)}
+        missing = sorted(expected - seen)
+        extra = len(seen - expected)
+        print(f'  coverage: {len(expected) - len(missing)} of {len(expected)} input ids, {len(missing)} missing, '
+              f'{extra} not in the input.')
+        if missing:
+            print(f'  missing ids: {", ".join(missing[:10])}{" ..." if len(missing) > 10 else ""}')
+        ok = ok and not missing
+    return ok
+
+
+def get_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='shard tools for CanRisk-DB screening')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    merge_parser = subparsers.add_parser('merge', help='Merge the outputs of `--shard i/N` runs.')
+    merge_parser.add_argument('output_files', nargs='+', help='Shard outputs (tsv without header).')
+    merge_parser.add_argument('-o', '--output', required=True, help='Merged output.')
+    merge_parser.add_argument('--input', type=str, default=None, help='Original input, to check coverage.')
+    merge_parser.add_argument('--input_format', type=str, default='auto', choices=INPUT_FORMATS,
+                              help='Format of --input, guessed from the extension by default.')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.command == 'merge':
+        sys.exit(0 if merge(args.output_files, args.output, args.input, args.input_format) else 1)
@@ -0,0 +1,72 @@
+# Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
+# SPDX-License-Identifier: MIT
+import re
+
+# effect sizes accepted by rule 5 of prompt_full_text_filter, abbreviations are matched case-sensitively
+_terms = (
+    r'(?<![A-Za-z])(?:a|adj\.?\s*)?(?:RR|HR|SIR|IRR)s?(?![A-Za-z])|'
+    r'(?i:(?:adjusted\s+)?(?:relative\s+risks?|risk\s+ratios?|hazards?\s+ratios?|incidence\s+rate\s+ratios?|'
+    r'standardi[sz]ed\s+incidence\s+ratios?))|'
+    r'相对危险度|相对风险|风险比|危险比|标准?化发病比'
+)
+_interval = (
+    r'(?i:95\s*%|\bCI\b|confidence\s+intervals?)|置信区间|'
+    r'[(\[]\s*\d+(?:\.\d+)?\s*(?:[-–—~,]|to)\s*\d+(?:\.\d+)?\s*[)\]]'
+)
+# a decimal estimate, so headers such as "HR (95% CI)" do not count
+_estimate = r'(?<![\d.])\d+\.\d+(?![\d.])(?!\s*%)'
+# an effect size name, an estimate and a confidence interval close to each other (text or table cells)
+STAT_PATTERN = re.compile(rf'(?:{_terms})[^\n]{{0,120}}?{_estimate}[^\n]{{0,60}}?(?:{_interval})')
+
+
+class StatChecker:
+    def __init__(self, reject=False, max_snippets=3, snippet_length=160):
+        """
+        Look for RR, HR or SIR (and variants such as aHR, IRR) reported with a confidence interval, required by rule 5
+        of the full text prompt.
+        :param reject: reject papers without any hit instead of sending them to the LLM
+        :param max_snippets: snippets kept in `Stat_snippets`
+        :param snippet_length: maximum length of one snippet
+        """
+        self.reject = reject
+        self.max_snippets = max_snippets
+        self.snippet_length = snippet_length
+        self.checked = 0
+        self.no_hit = 0
+        self.no_hit_accepted = 0
+
+    def scan(self, text):
+        """
+        :return: {'Stat_hits': number of hits, 'Stat_snippets': first hits separated by ` | `}
+        """
+        hits, snippets = 0, []
+        for match in STAT_PATTERN.finditer(text):
+            hits += 1
+            if len(snippets) < self.max_snippets:
+                # the match ends at the start of the interval, keep the rest of it
+                snippet = text[match.start():match.end() + 40].split('\n')[0]
+                snippets.append(' '.join(snippet.split())[:self.snippet_length])
+        return {'Stat_hits': hits, 'Stat_snippets': ' | '.join(snippets)}
+
+    def screen(self, columns):
+        """
+        :param columns: result of `scan`
+        :return: a `Rejected` response for a paper without hits in reject mode, else None
+        """
+        if self.reject and not columns['Stat_hits']:
+            return {'Decision': 'Rejected', 'Reason': 'other', 'Stat_check': 'rejected'}
+        return None
+
+    def record(self, response):
+        self.checked += 1
+        if not response.get('Stat_hits'):
+            self.no_hit += 1
+            if response.get('Decision') == 'Accepted':
+                self.no_hit_accepted += 1
+
+    def report(self):
+        verb = 'rejected' if self.reject else 'flagged'
+        print(f'statistic check: {self.no_hit} of {self.checked} papers without RR/HR/SIR and confidence interval '
+              f'{verb}.')
+        if not self.reject and self.no_hit:
+            print(f'  the LLM accepted {self.no_hit_accepted} of them.')
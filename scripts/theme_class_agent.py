@@ -15,10 +15,12 @@ async def theme_classifier_agent(content, model, lang, cycle=5):
                 {"role": "user", "content": prompts['theme_class'].render(content=content)},
             ]
 
-            respone = await async_respone(messages, model, temperature=0.01, top_p=0.7, max_tokens=12288, cycle=5)
+            respone = await async_respone(
+                messages, model, temperature=0.01, top_p=0.7, max_tokens=12288, cycle=5, refresh=i > 0)
             if respone.get('Run status', '') == "System Error":
                 return respone
             assert 'Decision' in respone.keys()
+            return respone
         except Exception as e:
             print(f"[{i}/{cycle}] Worker failed with error: {e}")
             if i == cycle - 1: